@@ -0,0 +1,108 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from game import NOT_A, NOT_H, FULL, State
+from players.AI import CORNERS, DISK_SQUARE_WEIGHTS, WEIGHTS
+
+
+def require_numpy():
+    if np is None:
+        raise Exception("NumPy is required for batch evaluation")
+
+
+def to_cells(boards):
+    """Converts an N x 64 array of states or an N x 2 array of (black, white)
+    bitboards into an N x 64 int8 array of states."""
+    require_numpy()
+    boards = np.asarray(boards)
+    if len(boards) == 0:
+        return np.zeros((0, 64), dtype=np.int8)
+    if boards.ndim == 2 and boards.shape[1] == 64:
+        return boards.astype(np.int8, copy=False)
+
+    bitboards = boards.astype("<u8")
+    black = np.unpackbits(bitboards[:, 0:1].view(np.uint8), axis=1,
+                          bitorder="little")
+    white = np.unpackbits(bitboards[:, 1:2].view(np.uint8), axis=1,
+                          bitorder="little")
+    return (black * State.black + white * State.white).astype(np.int8)
+
+
+def to_bitboards(cells):
+    black = np.packbits(cells == State.black, axis=1, bitorder="little")
+    white = np.packbits(cells == State.white, axis=1, bitorder="little")
+    return black.view("<u8")[:, 0], white.view("<u8")[:, 0]
+
+
+def popcount(masks):
+    return np.unpackbits(masks.view(np.uint8).reshape(-1, 8), axis=1).sum(1)
+
+
+def mobility(own, opp):
+    empty = ~(own | opp)
+    moves = np.zeros_like(own)
+    shifts = ((1, NOT_A, NOT_H), (7, NOT_H, NOT_A),
+              (8, FULL, FULL), (9, NOT_A, NOT_H))
+    for n, left_mask, right_mask in shifts:
+        n = np.uint64(n)
+        for shift, mask in ((np.left_shift, np.uint64(left_mask)),
+                            (np.right_shift, np.uint64(right_mask))):
+            om = opp & mask
+            x = shift(own, n) & om
+            for i in range(5):
+                x |= shift(x, n) & om
+            moves |= shift(x, n) & mask
+    return popcount(moves & empty)
+
+
+def ratio(B, W):
+    total = np.maximum(B + W, 1)
+    return np.where(B > W, 100.0 * B / total,
+                    np.where(B < W, -100.0 * W / total, 0.0))
+
+
+def features(boards):
+    """Returns the six AI.evaluate heuristics as an N x 6 float array."""
+    cells = to_cells(boards)
+    black = cells == State.black
+    white = cells == State.white
+    empty = cells == State.empty
+
+    # Piece difference
+    p = ratio(black.sum(1), white.sum(1))
+
+    # Corner occupancy and closeness
+    c = np.zeros(len(cells))
+    l = np.zeros(len(cells))
+    for corner, adjacent in CORNERS:
+        c += 25.0 * black[:, corner] - 25.0 * white[:, corner]
+        adjacent = list(adjacent)
+        l += empty[:, corner] * (12.5 * white[:, adjacent].sum(1) -
+                                 12.5 * black[:, adjacent].sum(1))
+
+    # Mobility
+    black_bits, white_bits = to_bitboards(cells)
+    m = ratio(mobility(black_bits, white_bits),
+              mobility(white_bits, black_bits))
+
+    # Frontier disks, counted once per empty neighbour
+    padded = np.zeros((len(cells), 10, 10), dtype=np.int8)
+    padded[:, 1:9, 1:9] = empty.reshape(-1, 8, 8)
+    empty_neighbours = sum(padded[:, 1 + drow:9 + drow, 1 + dcol:9 + dcol]
+                           for drow in (-1, 0, 1) for dcol in (-1, 0, 1)
+                           if drow or dcol).reshape(-1, 64)
+    f = -ratio((empty_neighbours * black).sum(1),
+               (empty_neighbours * white).sum(1))
+
+    # Disk squares
+    sigma = black.astype(np.int32) - white
+    d = sigma @ np.array(DISK_SQUARE_WEIGHTS, dtype=np.int32)
+
+    return np.stack((p, c, l, m, f, d), axis=1)
+
+
+def evaluate(boards, weights=WEIGHTS):
+    """Scores a batch of boards with AI.evaluate's weighted heuristics."""
+    return features(boards) @ np.array(weights, dtype=np.float64)
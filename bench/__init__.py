@@ -0,0 +1,5 @@
+"""Reproducible benchmarks for the boards, the evaluation and both AIs.
+
+Run `python -m bench` from the repository root. Results are written as JSON
+and can be compared against a saved baseline with `-c`.
+"""
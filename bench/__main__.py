@@ -0,0 +1,95 @@
+import argparse
+import json
+import platform
+import sys
+
+from bench.benchmarks import run
+from bench.checks import run_checks
+from bench.positions import position_set
+
+VERSION = 1
+
+
+def compare(results, baseline, threshold):
+    """Prints each benchmark's change against the baseline and returns
+    whether any of them got slower by more than threshold or changed its
+    checksum."""
+    failed = False
+    print("{:24} {:>10} {:>10} {:>8}".format("Benchmark", "Baseline", "Now",
+                                             "Change"))
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            print("{:24} {:>10} {:10.4f}".format(name, "-", result["time"]))
+            continue
+        before = baseline[name]
+        change = result["time"] / before["time"] - 1
+        note = ""
+        if result["checksum"] != before["checksum"]:
+            note = "checksum {} != {}".format(result["checksum"],
+                                              before["checksum"])
+            failed = True
+        elif change > threshold:
+            note = "slower"
+            failed = True
+        print("{:24} {:10.4f} {:10.4f} {:+8.1%}  {}".format(
+            name, before["time"], result["time"], change, note))
+    return failed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m bench",
+                                     description="Othello benchmarks")
+    parser.add_argument("-q", "--quick", action="store_true",
+                        help="Use fewer positions and shallower searches")
+    parser.add_argument("-r", "--repeats", type=int, default=3,
+                        help="The number of runs to take the best time of")
+    parser.add_argument("-k", "--only",
+                        help="Only run benchmarks whose name contains this")
+    parser.add_argument("-o", "--output",
+                        help="Write the results as JSON to this file")
+    parser.add_argument("-c", "--compare",
+                        help="A results file to compare against")
+    parser.add_argument("-t", "--threshold", type=float, default=0.1,
+                        help="The slowdown that counts as a regression")
+    parser.add_argument("--check", action="store_true",
+                        help="Check the optimized code paths against the "
+                             "reference ones instead of timing them")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        if not run_checks():
+            exit(1)
+        return
+
+    games = position_set(per_stage=2 if args.quick else 8)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    results = run(games, repeats=args.repeats, quick=args.quick,
+                  only=args.only, log=log)
+    report = {"version": VERSION,
+              "quick": args.quick,
+              "python": platform.python_version(),
+              "machine": platform.machine(),
+              "results": results}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("quick") != args.quick:
+            log("Warning: the baseline was run with quick={}"
+                .format(baseline.get("quick")))
+        if compare(results, baseline["results"], args.threshold):
+            exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
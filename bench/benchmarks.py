@@ -0,0 +1,253 @@
+from contextlib import contextmanager
+import ctypes
+import os
+import random
+import sys
+from time import perf_counter
+
+from game import BitBoard, OthelloBoard, State
+from bench.positions import replay
+from perft import c_perft, perft
+from tune import DEFAULT_WEIGHTS
+
+BOARD_TYPES = (("OthelloBoard", OthelloBoard), ("BitBoard", BitBoard))
+
+
+@contextmanager
+def quiet():
+    """Drops everything written to stdout, including the C engine's
+    printf output, while the benchmarked code runs."""
+    sys.stdout.flush()
+    saved_fd = os.dup(1)
+    saved_stdout = sys.stdout
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    sys.stdout = open(os.devnull, "w")
+    try:
+        yield
+    finally:
+        ctypes.CDLL(None).fflush(None)
+        sys.stdout.close()
+        sys.stdout = saved_stdout
+        os.dup2(saved_fd, 1)
+        os.close(saved_fd)
+        os.close(devnull)
+
+
+def best_time(function, repeats):
+    """Runs function repeats times and returns the fastest time along with
+    the function's result, which must be the same every time."""
+    best = None
+    result = None
+    for i in range(repeats):
+        start = perf_counter()
+        result = function()
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def legal_moves(games, board_type, calls=50):
+    boards = [replay(moves, board_type) for moves in games]
+
+    def run():
+        total = 0
+        for board, player in boards:
+            for i in range(calls):
+                total += len(board.legal_moves(player))
+        return total
+    return run, len(boards) * calls
+
+
+def make_move(games, board_type, rounds=20):
+    boards = [(board, player, board.legal_moves(player))
+              for board, player in (replay(moves, board_type)
+                                    for moves in games)]
+
+    def run():
+        flipped = 0
+        for i in range(rounds):
+            for board, player, moves in boards:
+                for row, col in moves:
+                    flipped += len(board.apply(row, col, player))
+                    board.undo()
+        return flipped
+    return run, rounds * sum(len(moves) for board, player, moves in boards)
+
+
+def perft_start(board_type, depth, count=perft):
+    def run():
+        return count(board_type(), State.black, depth)
+    return run, None
+
+
+def fixed_ai():
+    """Returns the Python AI with the built-in weights, no book and no
+    pattern tables, so that results do not depend on files written by the
+    tools."""
+    from players.AI import AI
+
+    class FixedAI(AI):
+        book_path = None
+        pattern_path = None
+        weights = DEFAULT_WEIGHTS
+    return FixedAI
+
+
+def evaluate_reference(games, rounds=10):
+    from players.AI import GameState
+
+    ai = fixed_ai()(State.black, None, 1)
+    states = [GameState(board, player=State.opponent(player))
+              for board, player in (replay(moves) for moves in games)]
+
+    def run():
+        return round(sum(ai.evaluate(state)
+                         for i in range(rounds) for state in states), 3)
+    return run, rounds * len(states)
+
+
+def evaluate_incremental(games, rounds=10):
+    from players.AI import Evaluator
+
+    # Scores every child of every position the way the search does: the
+    # evaluator is updated with push and pop around each move, and apply
+    # and undo are timed along with it
+    positions = [(board, player, board.legal_moves(player),
+                  Evaluator(board, DEFAULT_WEIGHTS))
+                 for board, player in (replay(moves, BitBoard)
+                                       for moves in games)]
+
+    def run():
+        total = 0
+        for i in range(rounds):
+            for board, player, moves, evaluator in positions:
+                for row, col in moves:
+                    flipped = board.apply(row, col, player)
+                    evaluator.push(row * 8 + col, player, flipped)
+                    total += evaluator.evaluate(board)
+                    evaluator.pop()
+                    board.undo()
+        return round(total, 3)
+    return run, rounds * sum(len(moves) for board, player, moves, evaluator
+                             in positions)
+
+
+def evaluate_patterns(games, rounds=10):
+    from array import array
+    from patterns import PatternEvaluator, PatternTables
+
+    # Tables of seeded random entries, so that the timing does not depend
+    # on a trained file
+    rng = random.Random(0)
+    tables = PatternTables(None, phases=4)
+    for phase_tables in tables.tables:
+        for number, table in enumerate(phase_tables):
+            phase_tables[number] = array("h", rng.randbytes(2 * len(table)))
+    evaluators = [(PatternEvaluator(board, tables), board)
+                  for board, player in (replay(moves) for moves in games)]
+
+    def run():
+        return round(sum(evaluator.evaluate(board) for i in range(rounds)
+                         for evaluator, board in evaluators), 3)
+    return run, rounds * len(evaluators)
+
+
+def evaluate_batch(games, rounds=10):
+    import batch
+
+    if batch.np is None:
+        raise ImportError("NumPy is not installed")
+    cells = [[board[square >> 3][square & 7] for square in range(64)]
+             for board, player in (replay(moves) for moves in games)]
+    cells *= rounds
+
+    def run():
+        return round(float(batch.evaluate(cells, DEFAULT_WEIGHTS).sum()), 3)
+    return run, len(cells)
+
+
+def search(player_class, games, depth, board_type=BitBoard, reset=None):
+    def run():
+        nodes = 0
+        for moves in games:
+            board, player = replay(moves, board_type)
+            if reset is not None:
+                reset()
+            ai = player_class(player, None, 3600)
+            ai.max_depth = depth
+            ai.endgame_empties = 0
+            with quiet():
+                ai.move(board)
+            nodes += ai.stats["nodes"]
+        return nodes
+    return run, None
+
+
+def search_ai(games, depth):
+    return search(fixed_ai(), games, depth)
+
+
+def search_cai(games, depth):
+    from players.cAI import cAI, lib
+
+    class FixedcAI(cAI):
+        book_path = None
+        pattern_path = None
+        weights = DEFAULT_WEIGHTS
+    return search(FixedcAI, games, depth, reset=lib.clearTable)
+
+
+def suite(games, quick=False):
+    """Returns (name, setup) pairs for every benchmark. Each setup returns a
+    function to time and the number of operations one run performs."""
+    benchmarks = []
+    for name, board_type in BOARD_TYPES:
+        benchmarks += [
+            ("legal_moves/" + name,
+             lambda board_type=board_type: legal_moves(games, board_type)),
+            ("make_move/" + name,
+             lambda board_type=board_type: make_move(games, board_type)),
+            ("perft/" + name,
+             lambda board_type=board_type: perft_start(board_type,
+                                                       5 if quick else 7)),
+        ]
+    benchmarks += [
+        ("perft/C", lambda: perft_start(BitBoard, 8 if quick else 10,
+                                        count=c_perft)),
+        ("evaluate/reference", lambda: evaluate_reference(games)),
+        ("evaluate/incremental", lambda: evaluate_incremental(games)),
+        ("evaluate/patterns", lambda: evaluate_patterns(games)),
+        ("evaluate/batch", lambda: evaluate_batch(games)),
+        ("search/AI", lambda: search_ai(games, 2 if quick else 4)),
+        ("search/cAI", lambda: search_cai(games, 6 if quick else 8)),
+    ]
+    return benchmarks
+
+
+def run(games, repeats=3, quick=False, only=None, log=None):
+    """Runs the suite and returns {name: result}. A result holds the best
+    time in seconds, a checksum (perft count, node count or score sum) that
+    must not change between runs of the same code, and the number of
+    operations per second when that is meaningful."""
+    results = {}
+    for name, setup in suite(games, quick=quick):
+        if only is not None and only not in name:
+            continue
+        try:
+            function, operations = setup()
+            elapsed, checksum = best_time(function, repeats)
+        except (ImportError, OSError) as e:
+            # Optional pieces such as NumPy or the compiled C engine
+            if log is not None:
+                log("Skipping {}: {}".format(name, e))
+            continue
+
+        result = {"time": elapsed, "checksum": checksum}
+        if operations is not None:
+            result["per_second"] = operations / elapsed
+        results[name] = result
+        if log is not None:
+            log("{:24} {:10.4f} s  {}".format(name, elapsed, checksum))
+    return results
@@ -0,0 +1,165 @@
+"""Correctness checks for the optimized code paths, run with
+python -m bench --check. Each check returns a list of failure messages."""
+
+from array import array
+import contextlib
+import io
+import random
+
+from game import BitBoard, OthelloBoard, State
+
+
+def random_walk(board, rng, callback):
+    """Plays a random game on board, calling callback(move, player, flipped)
+    after each move, and returns the moves as (row, col, player)."""
+    player = State.black
+    moves = []
+    stuck = 0
+    while stuck < 2:
+        possible = board.legal_moves(player)
+        if not possible:
+            stuck += 1
+        else:
+            stuck = 0
+            row, col = rng.choice(possible)
+            flipped = board.apply(row, col, player)
+            moves.append((row, col, player))
+            callback((row, col), player, flipped)
+        player = State.opponent(player)
+    return moves
+
+
+def check_incremental(games=20, seed=0):
+    """Plays random games with Evaluator push/pop and compares its score
+    with the full AI.evaluate after every move and every undo."""
+    from players.AI import AI, Evaluator, GameState
+
+    class Reference(AI):
+        book_path = None
+        pattern_path = None
+    reference = Reference(State.black, None, 1)
+    rng = random.Random(seed)
+    failures = []
+    for game in range(games):
+        for board_type in (OthelloBoard, BitBoard):
+            board = board_type()
+            evaluator = Evaluator(board, reference.weights)
+
+            def compare(when):
+                state = GameState(board, player=State.black)
+                full = reference.evaluate(state)
+                score = evaluator.evaluate(board)
+                if abs(full - score) > 1e-6:
+                    failures.append("{} game {} {}: incremental {} != full "
+                                    "{}".format(board_type.__name__, game,
+                                                when, score, full))
+
+            def push(move, player, flipped):
+                evaluator.push(move[0] * 8 + move[1], player, flipped)
+                compare("after {} moves".format(len(evaluator.stack)))
+
+            random_walk(board, rng, push)
+            while evaluator.stack:
+                evaluator.pop()
+                board.undo()
+                compare("undone to {} moves".format(len(evaluator.stack)))
+    return failures
+
+
+def check_pattern_symmetry(games=5, seed=0):
+    """Scores the positions of random games in all eight orientations with
+    symmetrized random pattern tables, which must agree for the canonical
+    transposition table keys to be sound."""
+    from game import transform
+    from patterns import PATTERNS, PatternTables
+
+    rng = random.Random(seed)
+    tables = PatternTables(None, phases=4)
+    for p in range(tables.phases):
+        for number, (name, size, instances) in enumerate(PATTERNS):
+            tables.tables[p][number] = array(
+                "h", [rng.randrange(-2000, 2000) for i in range(3 ** size)])
+    tables.symmetrize()
+
+    failures = []
+    for game in range(games):
+        board = BitBoard()
+
+        def compare(move, player, flipped):
+            scores = []
+            for t in range(8):
+                image = BitBoard()
+                image.black = transform(t, board.black)
+                image.white = transform(t, board.white)
+                scores.append(tables.evaluate(image))
+            if len(set(scores)) > 1:
+                failures.append("game {} after {} disks: {}".format(
+                    game, board.total_count(), scores))
+
+        random_walk(board, rng, compare)
+    return failures
+
+
+def check_root_entry(positions=10, disks=24, depth=3, seed=0):
+    """Searches random positions with more than canonical_disks disks, whose
+    table keys are plain Zobrist keys, and checks that the root entry stored
+    by iterate is found by a probe and holds the chosen move."""
+    from players.AI import AI, TranspositionTable, zobrist_key
+
+    class Searcher(AI):
+        book_path = None
+        pattern_path = None
+        endgame_empties = 0
+        max_depth = depth
+
+    rng = random.Random(seed)
+    failures = []
+    found = 0
+    while found < positions:
+        board = BitBoard()
+        last = []
+
+        def stop(move, player, flipped):
+            last[:] = [player]
+            if board.total_count() == disks:
+                raise StopIteration
+
+        try:
+            random_walk(board, rng, stop)
+        except StopIteration:
+            pass
+        player = State.opponent(last[0])
+        if board.total_count() != disks or not board.legal_moves(player):
+            continue
+        found += 1
+
+        ai = Searcher(player, None, 3600)
+        with contextlib.redirect_stdout(io.StringIO()):
+            move = ai.move(board)
+        table_key, t = ai.table_key(board, player, zobrist_key(board, player))
+        entry = ai.table.probe(table_key)
+        if entry is None:
+            failures.append("position {}: no root entry".format(found))
+        elif entry[TranspositionTable.MOVE] != move or \
+                entry[TranspositionTable.DEPTH] != depth:
+            failures.append("position {}: root entry {} for move {}".format(
+                found, entry, move))
+    return failures
+
+
+CHECKS = (("incremental evaluation", check_incremental),
+          ("root table entry", check_root_entry),
+          ("pattern symmetry", check_pattern_symmetry))
+
+
+def run_checks(log=print):
+    """Runs every check and returns whether they all passed."""
+    passed = True
+    for name, check in CHECKS:
+        failures = check()
+        for failure in failures[:10]:
+            log("  " + failure)
+        log("{}: {}".format(name, "ok" if not failures else
+                            "{} failures".format(len(failures))))
+        passed = passed and not failures
+    return passed
@@ -0,0 +1,57 @@
+import random
+
+from game import OthelloBoard, State
+
+# Number of disks on the board for each stage of the fixed position set
+STAGES = (12, 24, 36, 48)
+
+
+def random_game(rng, disks):
+    """Plays random moves from the start until the board holds at least
+    the given number of disks. Returns the moves, with None for a pass, or
+    None if the game ended first."""
+    board = OthelloBoard()
+    player = State.black
+    moves = []
+    stuck = 0
+    while board.total_count() < disks:
+        possible = board.legal_moves(player)
+        if not possible:
+            stuck += 1
+            if stuck == 2:
+                return None
+            moves.append(None)
+        else:
+            stuck = 0
+            move = rng.choice(possible)
+            board.make_move(move[0], move[1], player)
+            moves.append(move)
+        player = State.opponent(player)
+    return moves
+
+
+def position_set(per_stage=8, stages=STAGES, seed=2015):
+    """Returns a fixed list of move sequences, per_stage of them for each
+    number of disks in stages."""
+    rng = random.Random(seed)
+    games = []
+    for disks in stages:
+        found = 0
+        while found < per_stage:
+            moves = random_game(rng, disks)
+            if moves is not None:
+                games.append(moves)
+                found += 1
+    return games
+
+
+def replay(moves, board_type=OthelloBoard):
+    """Returns the board reached by a move sequence and the player to
+    move."""
+    board = board_type()
+    player = State.black
+    for move in moves:
+        if move is not None:
+            board.make_move(move[0], move[1], player)
+        player = State.opponent(player)
+    return board, player
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""Opening book: a sorted binary file of positions keyed by a hash of their
+symmetry-reduced form, built from self-play and read through mmap by both the
+Python and the C players."""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import mmap
+import os
+import random
+import struct
+import sys
+
+from game import FULL, BitBoard, State, inverse_move, silence, transform_move
+
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "book.bin")
+
+MAGIC = b"OTHBOOK1"
+HEADER = struct.Struct("<8sQ")    # magic, number of records
+RECORD = struct.Struct("<QBbH")   # key, square, average score, games
+
+
+def mix64(x):
+    x ^= x >> 33
+    x = (x * 0xFF51AFD7ED558CCD) & FULL
+    x ^= x >> 33
+    x = (x * 0xC4CEB9FE1A85EC53) & FULL
+    x ^= x >> 33
+    return x
+
+
+def position_key(own, opp):
+    # Must match hashPosition(own, opp, BLACK) in players/cAI/cAI.c
+    return mix64(own ^ mix64((opp + 0x9E3779B97F4A7C15) & FULL))
+
+
+class OpeningBook(object):
+
+    def __init__(self, path=BOOK_PATH):
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise Exception("'{}' is not an opening book".format(path))
+        if len(self.data) != HEADER.size + self.size * RECORD.size:
+            raise Exception("'{}' is truncated".format(path))
+
+    def find(self, key):
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = RECORD.unpack_from(self.data,
+                                        HEADER.size + mid * RECORD.size)
+            if record[0] < key:
+                lo = mid + 1
+            elif record[0] > key:
+                hi = mid
+            else:
+                return record
+        return None
+
+    def lookup(self, board, player):
+        own, opp, t = board.canonical(player)
+        record = self.find(position_key(own, opp))
+        if record is None:
+            return None
+
+        move = inverse_move(t, (record[1] >> 3, record[1] & 7))
+        # Guard against hash collisions
+        if move not in board.legal_moves(player):
+            return None
+        return move
+
+
+def write_book(path, entries):
+    """Writes {key: (square, score, games)} as a book file."""
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(entries)))
+        for key in sorted(entries):
+            square, score, games = entries[key]
+            f.write(RECORD.pack(key, square,
+                                max(-64, min(64, int(round(score)))),
+                                min(games, 0xFFFF)))
+
+
+def self_play(job):
+    """Plays one game and returns the book plies as (key, canonical square,
+    player) along with the final disk counts."""
+    player_name, timeout, plies, explore, seed = job
+    module = __import__("players." + player_name, fromlist=[player_name])
+    player_class = getattr(module, player_name)
+    players = {State.black: player_class(State.black, None, timeout),
+               State.white: player_class(State.white, None, timeout)}
+    rng = random.Random(seed)
+
+    board = BitBoard()
+    player = State.black
+    history = []
+    stuck = 0
+    while stuck < 2:
+        moves = board.legal_moves(player)
+        if not moves:
+            stuck += 1
+        else:
+            stuck = 0
+            if len(history) < plies and rng.random() < explore:
+                move = rng.choice(moves)
+            else:
+                move = players[player].move(board)
+
+            if len(history) < plies:
+                own, opp, t = board.canonical(player)
+                row, col = transform_move(t, move)
+                history.append((position_key(own, opp), row * 8 + col,
+                                player))
+            board.make_move(move[0], move[1], player)
+        player = State.opponent(player)
+
+    return history, board.count(State.black), board.count(State.white)
+
+
+def build(player_name, games, plies=12, explore=0.25, timeout=0.5,
+          min_games=2, seed=0):
+    # stats[key][square] = [games, total final disk difference for the mover]
+    stats = {}
+    jobs = [(player_name, timeout, plies, explore, seed + i)
+            for i in range(games)]
+    with ProcessPoolExecutor(max_workers=os.cpu_count(),
+                             initializer=silence) as executor:
+        for history, black, white in executor.map(self_play, jobs):
+            for key, square, player in history:
+                result = black - white if player is State.black else \
+                    white - black
+                entry = stats.setdefault(key, {}).setdefault(square, [0, 0])
+                entry[0] += 1
+                entry[1] += result
+
+    entries = {}
+    for key, squares in stats.items():
+        candidates = [(total / count, count, square)
+                      for square, (count, total) in squares.items()
+                      if count >= min_games]
+        if candidates:
+            score, count, square = max(candidates)
+            entries[key] = (square, score, count)
+    return entries
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Othello opening book")
+    parser.add_argument("-p", "--player", default="cAI",
+                        help="The player used for self-play games")
+    parser.add_argument("-n", "--games", type=int, default=100,
+                        help="The number of self-play games")
+    parser.add_argument("-d", "--plies", type=int, default=12,
+                        help="The number of plies to keep in the book")
+    parser.add_argument("-e", "--explore", type=float, default=0.25,
+                        help="The chance of a random move inside the book")
+    parser.add_argument("-T", "--timeout", type=float, default=0.5,
+                        help="The time limit passed to the players")
+    parser.add_argument("-m", "--min-games", type=int, default=2,
+                        help="The number of games a move needs to be kept")
+    parser.add_argument("-o", "--output", default=BOOK_PATH)
+    args = parser.parse_args(argv)
+
+    entries = build(args.player, args.games, plies=args.plies,
+                    explore=args.explore, timeout=args.timeout,
+                    min_games=args.min_games)
+    write_book(args.output, entries)
+    print("Wrote {} positions to {}".format(len(entries), args.output))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
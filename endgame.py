@@ -0,0 +1,84 @@
+from time import time
+
+from game import FULL, bit_squares, flip_mask, legal_mask
+
+# Quadrants of the board, used for parity move ordering
+QUADRANTS = (0x000000000F0F0F0F, 0x00000000F0F0F0F0,
+             0x0F0F0F0F00000000, 0xF0F0F0F000000000)
+
+# Below this many empty squares moves are searched in plain order, since
+# ordering them costs more than it saves
+MIN_ORDERING_EMPTIES = 5
+
+
+class SolverTimeout(Exception):
+    pass
+
+
+class EndgameSolver(object):
+    """Exact endgame search. Scores are the final disk difference from the
+    point of view of the player to move."""
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self.nodes = 0
+
+    def children(self, own, opp, moves):
+        children = []
+        for square in bit_squares(moves):
+            move = 1 << square
+            flips = flip_mask(own, opp, move)
+            children.append((square, own | move | flips, opp ^ flips))
+
+        empty = ~(own | opp) & FULL
+        if len(children) > 1 and empty.bit_count() >= MIN_ORDERING_EMPTIES:
+            # Fastest first: leave the opponent as few replies as possible,
+            # then prefer regions with an odd number of empty squares
+            odd = 0
+            for quadrant in QUADRANTS:
+                if (empty & quadrant).bit_count() & 1:
+                    odd |= quadrant
+            children.sort(key=lambda child: (
+                legal_mask(child[2], child[1]).bit_count(),
+                not (odd >> child[0]) & 1
+            ))
+        return children
+
+    def solve(self, own, opp, alpha=-64, beta=64, passed=False):
+        self.nodes += 1
+        if self.deadline is not None and not self.nodes & 1023 and \
+           time() >= self.deadline:
+            raise SolverTimeout()
+
+        moves = legal_mask(own, opp)
+        if not moves:
+            if passed:
+                return own.bit_count() - opp.bit_count()
+            return -self.solve(opp, own, -beta, -alpha, True)
+
+        best = -65
+        for square, new_own, new_opp in self.children(own, opp, moves):
+            score = -self.solve(new_opp, new_own, -beta, -alpha)
+            if score > best:
+                best = score
+                if best > alpha:
+                    alpha = best
+                    if alpha >= beta:
+                        break
+        return best
+
+    def best_move(self, own, opp):
+        """Returns (score, (row, col)) for the best move, or (score, None)
+        if the player to move has to pass."""
+        moves = legal_mask(own, opp)
+        if not moves:
+            return self.solve(own, opp), None
+
+        alpha = -65
+        best_square = None
+        for square, new_own, new_opp in self.children(own, opp, moves):
+            score = -self.solve(new_opp, new_own, -64, -alpha)
+            if score > alpha:
+                alpha = score
+                best_square = square
+        return alpha, (best_square >> 3, best_square & 7)
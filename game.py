@@ -1,6 +1,8 @@
 from copy import deepcopy
 import multiprocessing as mp
-import queue
+import os
+import sys
+from time import time
 from players.Human import Human
 
 
@@ -28,6 +30,10 @@ class InvalidMoveException(Exception):
     pass
 
 
+class PlayerTimeoutException(Exception):
+    pass
+
+
 class OthelloBoard(object):
     directions = ((-1, 0),   # N
                   (-1, 1),   # NE
@@ -38,6 +44,9 @@ class OthelloBoard(object):
                   (0, -1),   # W
                   (-1, -1))  # NW
 
+    # When set, every count query is cross-checked against a full recount
+    debug = False
+
     def __init__(self):
         # self.board uses the form self.board[row][column]
         self.board = [[State.empty for i in range(8)] for j in range(8)]
@@ -46,6 +55,11 @@ class OthelloBoard(object):
         self.board[4][3] = State.black
         self.board[4][4] = State.white
 
+        # Disk counts indexed by state, kept up to date by make_move
+        self.counts = [60, 2, 2]
+        # (row, col, player, flipped squares) for every move made by apply
+        self.history = []
+
     def move_would_capture(self, row, col, player):
         opponent = State.opponent(player)
 
@@ -81,6 +95,25 @@ class OthelloBoard(object):
                         possible.append((row, col))
         return possible
 
+    def mobility(self, player):
+        return len(self.legal_moves(player))
+
+    def masks(self, player):
+        opponent = State.opponent(player)
+        own = opp = 0
+        for row in range(8):
+            for col in range(8):
+                if self.board[row][col] is player:
+                    own |= 1 << (row * 8 + col)
+                elif self.board[row][col] is opponent:
+                    opp |= 1 << (row * 8 + col)
+        return own, opp
+
+    def canonical(self, player):
+        """Returns the player's and the opponent's masks in canonical form
+        along with the transform that maps moves onto it."""
+        return canonical(*self.masks(player))
+
     def make_move(self, row, col, player):
         if not self.move_would_capture(row, col, player):
             raise InvalidMoveException()
@@ -88,6 +121,7 @@ class OthelloBoard(object):
         self.board[row][col] = player
 
         opponent = State.opponent(player)
+        flipped = []
         for drow, dcol in OthelloBoard.directions:
             rowp = row + drow
             colp = col + dcol
@@ -110,11 +144,34 @@ class OthelloBoard(object):
 
                 while not (rowp == row and colp == col):
                     self.board[rowp][colp] = player
+                    flipped.append(rowp * 8 + colp)
 
                     rowp -= drow
                     colp -= dcol
 
-    def count(self, player):
+        self.counts[player] += len(flipped) + 1
+        self.counts[opponent] -= len(flipped)
+        self.counts[State.empty] -= 1
+        return flipped
+
+    def apply(self, row, col, player):
+        flipped = self.make_move(row, col, player)
+        self.history.append((row, col, player, flipped))
+        return flipped
+
+    def undo(self):
+        row, col, player, flipped = self.history.pop()
+        opponent = State.opponent(player)
+
+        self.board[row][col] = State.empty
+        for square in flipped:
+            self.board[square >> 3][square & 7] = opponent
+
+        self.counts[player] -= len(flipped) + 1
+        self.counts[opponent] += len(flipped)
+        self.counts[State.empty] += 1
+
+    def recount(self, player):
         total = 0
         for row in range(8):
             for col in range(8):
@@ -122,13 +179,23 @@ class OthelloBoard(object):
                     total += 1
         return total
 
+    def check_counts(self):
+        for state in (State.empty, State.black, State.white):
+            if self.counts[state] != self.recount(state):
+                raise Exception("Disk count for state {} is {} but the "
+                                "board has {}".format(state,
+                                                      self.counts[state],
+                                                      self.recount(state)))
+
+    def count(self, player):
+        if OthelloBoard.debug:
+            self.check_counts()
+        return self.counts[player]
+
     def total_count(self):
-        total = 0
-        for row in range(8):
-            for col in range(8):
-                if self.board[row][col] is not State.empty:
-                    total += 1
-        return total
+        if OthelloBoard.debug:
+            self.check_counts()
+        return 64 - self.counts[State.empty]
 
     def leader(self):
         b = self.count(State.black)
@@ -150,10 +217,356 @@ class OthelloBoard(object):
         return str(self)
 
 
+FULL = 0xFFFFFFFFFFFFFFFF
+NOT_A = 0xFEFEFEFEFEFEFEFE  # every column except column 0
+NOT_H = 0x7F7F7F7F7F7F7F7F  # every column except column 7
+
+# Square (row, col) is bit row * 8 + col. Left shifts move towards higher
+# rows/columns, right shifts towards lower ones; the masks drop the bits that
+# would wrap around to the other side of the board.
+LEFT_SHIFTS = ((1, NOT_A),   # E
+               (7, NOT_H),   # SW
+               (8, FULL),    # S
+               (9, NOT_A))   # SE
+RIGHT_SHIFTS = ((1, NOT_H),  # W
+                (7, NOT_A),  # NE
+                (8, FULL),   # N
+                (9, NOT_H))  # NW
+
+
+def bit_squares(mask):
+    squares = []
+    while mask:
+        low = mask & -mask
+        squares.append(low.bit_length() - 1)
+        mask ^= low
+    return squares
+
+
+def legal_mask(own, opp):
+    empty = ~(own | opp) & FULL
+    moves = 0
+    for n, mask in LEFT_SHIFTS:
+        om = opp & mask
+        x = (own << n) & om
+        x |= (x << n) & om
+        x |= (x << n) & om
+        x |= (x << n) & om
+        x |= (x << n) & om
+        x |= (x << n) & om
+        moves |= (x << n) & mask
+    for n, mask in RIGHT_SHIFTS:
+        om = opp & mask
+        x = (own >> n) & om
+        x |= (x >> n) & om
+        x |= (x >> n) & om
+        x |= (x >> n) & om
+        x |= (x >> n) & om
+        x |= (x >> n) & om
+        moves |= (x >> n) & mask
+    return moves & empty
+
+
+def flip_mask(own, opp, move):
+    flips = 0
+    for n, mask in LEFT_SHIFTS:
+        f = 0
+        x = (move << n) & mask
+        while x & opp:
+            f |= x
+            x = (x << n) & mask
+        if x & own:
+            flips |= f
+    for n, mask in RIGHT_SHIFTS:
+        f = 0
+        x = (move >> n) & mask
+        while x & opp:
+            f |= x
+            x = (x >> n) & mask
+        if x & own:
+            flips |= f
+    return flips
+
+
+# The eight symmetries of the board. Transform t transposes the board if
+# t & 4, then flips the rows if t & 2, then flips the columns if t & 1.
+def flip_rows(mask):
+    return int.from_bytes(mask.to_bytes(8, "little"), "big")
+
+
+def flip_columns(mask):
+    mask = ((mask >> 1) & 0x5555555555555555) | \
+           ((mask & 0x5555555555555555) << 1)
+    mask = ((mask >> 2) & 0x3333333333333333) | \
+           ((mask & 0x3333333333333333) << 2)
+    mask = ((mask >> 4) & 0x0F0F0F0F0F0F0F0F) | \
+           ((mask & 0x0F0F0F0F0F0F0F0F) << 4)
+    return mask
+
+
+def transpose(mask):
+    t = 0x0F0F0F0F00000000 & (mask ^ (mask << 28))
+    mask ^= t ^ (t >> 28)
+    t = 0x3333000033330000 & (mask ^ (mask << 14))
+    mask ^= t ^ (t >> 14)
+    t = 0x5500550055005500 & (mask ^ (mask << 7))
+    mask ^= t ^ (t >> 7)
+    return mask
+
+
+def transform(t, mask):
+    if t & 4:
+        mask = transpose(mask)
+    if t & 2:
+        mask = flip_rows(mask)
+    if t & 1:
+        mask = flip_columns(mask)
+    return mask
+
+
+def inverse_transform(t, mask):
+    if t & 1:
+        mask = flip_columns(mask)
+    if t & 2:
+        mask = flip_rows(mask)
+    if t & 4:
+        mask = transpose(mask)
+    return mask
+
+
+def transform_move(t, move):
+    if not t:
+        return move
+    square = transform(t, 1 << (move[0] * 8 + move[1])).bit_length() - 1
+    return (square >> 3, square & 7)
+
+
+def inverse_move(t, move):
+    if not t:
+        return move
+    square = inverse_transform(t, 1 << (move[0] * 8 + move[1])) \
+        .bit_length() - 1
+    return (square >> 3, square & 7)
+
+
+def canonical(own, opp):
+    """Returns (own, opp, t) for the smallest of the eight symmetric forms
+    of the position and the transform t that produces it."""
+    best = (own, opp, 0)
+    for t in range(1, 8):
+        form = (transform(t, own), transform(t, opp), t)
+        if form < best:
+            best = form
+    return best
+
+
+class BitBoard(object):
+    """Drop-in replacement for OthelloBoard that stores the position as one
+    64-bit mask per player."""
+
+    def __init__(self):
+        self.black = (1 << 28) | (1 << 35)  # d5, e4
+        self.white = (1 << 27) | (1 << 36)  # d4, e5
+        # (move bit, flip mask, player) for every move made by apply
+        self.history = []
+
+    def masks(self, player):
+        if player is State.black:
+            return self.black, self.white
+        elif player is State.white:
+            return self.white, self.black
+        raise Exception("Invalid player")
+
+    def canonical(self, player):
+        return canonical(*self.masks(player))
+
+    def move_would_capture(self, row, col, player):
+        own, opp = self.masks(player)
+        return flip_mask(own, opp, 1 << (row * 8 + col)) != 0
+
+    def legal_moves(self, player):
+        own, opp = self.masks(player)
+        return [(sq >> 3, sq & 7) for sq in bit_squares(legal_mask(own, opp))]
+
+    def mobility(self, player):
+        own, opp = self.masks(player)
+        return legal_mask(own, opp).bit_count()
+
+    def move_masks(self, row, col, player):
+        own, opp = self.masks(player)
+        move = 1 << (row * 8 + col)
+        flips = flip_mask(own, opp, move) if not (own | opp) & move else 0
+        if not flips:
+            raise InvalidMoveException()
+        return move, flips
+
+    def make_move(self, row, col, player):
+        move, flips = self.move_masks(row, col, player)
+        self.place(move, flips, player)
+        return bit_squares(flips)
+
+    def place(self, move, flips, player):
+        if player is State.black:
+            self.black |= move | flips
+            self.white ^= flips
+        else:
+            self.white |= move | flips
+            self.black ^= flips
+
+    def apply(self, row, col, player):
+        move, flips = self.move_masks(row, col, player)
+        self.place(move, flips, player)
+        self.history.append((move, flips, player))
+        return bit_squares(flips)
+
+    def undo(self):
+        move, flips, player = self.history.pop()
+        if player is State.black:
+            self.black ^= move | flips
+            self.white |= flips
+        else:
+            self.white ^= move | flips
+            self.black |= flips
+
+    # Counts come straight from the masks, so there is nothing to keep in
+    # step with apply and undo
+    def count(self, player):
+        if player is State.black:
+            return self.black.bit_count()
+        elif player is State.white:
+            return self.white.bit_count()
+        return 64 - (self.black | self.white).bit_count()
+
+    def total_count(self):
+        return (self.black | self.white).bit_count()
+
+    def leader(self):
+        b = self.count(State.black)
+        w = self.count(State.white)
+        if b > w:
+            return State.black
+        if b < w:
+            return State.white
+        return State.draw
+
+    def row(self, row):
+        black = self.black >> (row * 8)
+        white = self.white >> (row * 8)
+        return [State.black if black & (1 << col) else
+                State.white if white & (1 << col) else
+                State.empty for col in range(8)]
+
+    @property
+    def board(self):
+        return [self.row(row) for row in range(8)]
+
+    def __getitem__(self, key):
+        if not -8 <= key < 8:
+            raise IndexError("row index out of range")
+        return self.row(key % 8)
+
+    def __iter__(self):
+        return iter(self.board)
+
+    def __str__(self):
+        return "\n".join("".join(map(str, l)) for l in self.board) \
+                   .replace("0", ".")
+
+    def __repr__(self):
+        return str(self)
+
+
+def silence():
+    """Drops everything the calling process prints, for worker processes
+    that play headless games."""
+    # Redirect the file descriptor too so output from the C engine is dropped
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+    sys.stdout = open(os.devnull, "w")
+
+
+class PlayerWorker(object):
+    """Runs a player in a long-lived child process so that it keeps its
+    state (such as search caches) from one move to the next."""
+
+    def __init__(self, player):
+        self.player = player
+        self.process = None
+        self.conn = None
+
+    @staticmethod
+    def serve(conn, player):
+        # Requests are ("move", board), answered with (move, stats), and
+        # ("ponder", board), which lets the player search on the opponent's
+        # time until the next request arrives
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                return
+            if request is None:
+                return
+            kind, board = request
+            if kind == "ponder":
+                player.ponder(board, conn.poll)
+            else:
+                move = player.move(board)
+                conn.send((move, player.stats))
+
+    def start(self):
+        self.conn, child_conn = mp.Pipe()
+        self.process = mp.Process(target=PlayerWorker.serve,
+                                  args=(child_conn, self.player),
+                                  daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def move(self, board, timeout):
+        """Returns the player's move and its statistics for the move."""
+        if self.process is None:
+            self.start()
+
+        self.conn.send(("move", board))
+        try:
+            if self.conn.poll(timeout):
+                return self.conn.recv()
+        except EOFError:
+            pass
+
+        # The player is stuck or has died, so start over with a fresh
+        # process the next time a move is requested
+        self.kill()
+        raise PlayerTimeoutException()
+
+    def ponder(self, board):
+        """Tells the player the position after its move, which it may
+        search until its next move is requested."""
+        if self.process is not None:
+            self.conn.send(("ponder", board))
+
+    def kill(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.conn.close()
+            self.process = None
+
+    def stop(self):
+        if self.process is not None:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, EOFError):
+                pass
+            self.process.join(1)
+            self.kill()
+
+
 class OthelloGame(object):
 
-    def __init__(self, player_1, player_2, ui=None, timeout=None):
+    def __init__(self, player_1, player_2, ui=None, timeout=None,
+                 board_type=None, ponder=False):
         self.timeout = timeout or 3
+        # Let AIs search during their opponent's turn
+        self.ponder = ponder
 
         if ui is None:
             try:
@@ -173,9 +586,14 @@ class OthelloGame(object):
 
         self.players = (player_1(State.black, get_move_1, self.timeout),
                         player_2(State.white, get_move_2, self.timeout))
-        self.board = OthelloBoard()
+        self.workers = tuple(None if isinstance(player, Human) else
+                             PlayerWorker(player) for player in self.players)
+        self.board = (board_type or OthelloBoard)()
         self.player = State.black
         self.moves = []
+        # One entry per turn: the player, the move (None for a pass), the
+        # wall time taken and the statistics the player reported
+        self.record = []
 
     def next_player(self):
         opp = State.opponent(self.player)
@@ -187,12 +605,16 @@ class OthelloGame(object):
         return self.players[opp_index]
 
     def play(self, silent=False):
-        if silent:
-            def cprint(*args, **kwargs):
+        names = {State.black: "Black", State.white: "White"}
+
+        # Messages are formatted here, so nothing is built when silent
+        def cprint(message="", *args, underline=False):
+            if silent:
                 return
-        else:
-            def cprint(*args, **kwargs):
-                print(*args, **kwargs)
+            message = message.format(*args)
+            print(message)
+            if underline:
+                print("-" * len(message))
 
         parent_return_pipe, child_return_pipe = mp.Pipe(duplex=False)
 
@@ -203,56 +625,40 @@ class OthelloGame(object):
             turn = 1
 
             while squares < 64 and stuck < 2:
-                move_title = ("#" + str(turn) + ": " +
-                              State.player_name(self.player).capitalize() +
-                              "'s turn")
-                cprint(move_title)
-                cprint("-" * len(move_title))
+                cprint("#{}: {}'s turn", turn, names[self.player],
+                       underline=True)
                 self.ui.update()
 
                 possible = self.board.legal_moves(self.player)
+                opponent = State.opponent(self.player)
 
                 if len(possible) == 0:
                     stuck += 1
-                    cprint(State.player_name(self.player).capitalize(),
-                           "passes")
+                    cprint("{} passes", names[self.player])
                     move = None
+                    stats = {}
+                    elapsed = 0.0
                 else:
+                    start_time = time()
                     if isinstance(player, Human):
                         move = player.move(deepcopy(self.board))
+                        stats = player.stats
                     else:
-                        make_move_with_timeout = (
-                            lambda q, player, board: q.put(player.move(board))
-                        )
-                        q = mp.Queue()
-                        p = mp.Process(target=make_move_with_timeout,
-                                       args=(q, player, deepcopy(self.board)))
-                        p.start()
+                        worker = self.workers[self.players.index(player)]
                         try:
-                            move = q.get(timeout=self.timeout)
-                        except queue.Empty:
-                            if p.is_alive():
-                                p.terminate()
-
-                            if self.player is State.black:
-                                cprint("Black is disqualified for "
-                                       "taking too much time.")
-                                child_return_pipe.send(State.white)
-                            else:
-                                cprint("White is disqualified for "
-                                       "taking too much time.")
-                                child_return_pipe.send(State.black)
+                            move, stats = worker.move(self.board,
+                                                      self.timeout)
+                        except PlayerTimeoutException:
+                            cprint("{} is disqualified for taking too much "
+                                   "time.", names[self.player])
+                            child_return_pipe.send(opponent)
                             return
+                    elapsed = time() - start_time
 
                     if move is None:
-                        if self.player is State.black:
-                            cprint("Black is disqualified for "
-                                   "passing illegally.")
-                            child_return_pipe.send(State.white)
-                        else:
-                            cprint("White is disqualified for "
-                                   "passing illegally.")
-                            child_return_pipe.send(State.black)
+                        cprint("{} is disqualified for passing illegally.",
+                               names[self.player])
+                        child_return_pipe.send(opponent)
                         return
                     else:
                         if move not in possible:
@@ -260,43 +666,40 @@ class OthelloGame(object):
                                 cprint("Illegal move!\n")
                                 continue
 
-                            if self.player is State.black:
-                                cprint("Black is disqualified for "
-                                       "making an illegal move.")
-                                child_return_pipe.send(State.white)
-                            else:
-                                cprint("White is disqualified for "
-                                       "making an illegal move.")
-                                child_return_pipe.send(State.black)
+                            cprint("{} is disqualified for making an illegal "
+                                   "move.", names[self.player])
+                            child_return_pipe.send(opponent)
                             return
 
                         self.board.make_move(move[0], move[1], self.player)
-
-                        move_code = "abcdefgh"[move[1]] + str(move[0] + 1)
-                        cprint(State.player_name(self.player).capitalize(),
-                               "moves",
-                               move_code)
-                        cprint("Black:",
-                               self.board.count(State.black),
-                               "disks")
-                        cprint("White:",
-                               self.board.count(State.white),
-                               "disks")
+                        if self.ponder and not isinstance(player, Human):
+                            worker.ponder(self.board)
+
+                        cprint("{} moves {}{}", names[self.player],
+                               "abcdefgh"[move[1]], move[0] + 1)
+                        cprint("Black: {} disks",
+                               self.board.count(State.black))
+                        cprint("White: {} disks",
+                               self.board.count(State.white))
                         stuck = 0
                         squares += 1
 
                 self.moves.append(move)
+                self.record.append({"player": self.player,
+                                    "move": move,
+                                    "time": elapsed,
+                                    "stats": stats})
                 turn += 1
                 player = self.next_player()
                 cprint()
 
-            cprint("Results\n-------")
+            cprint("Results", underline=True)
             self.ui.update()
 
             white = self.board.count(State.white)
             black = self.board.count(State.black)
-            cprint("Black:", black, "disks")
-            cprint("White:", white, "disks")
+            cprint("Black: {} disks", black)
+            cprint("White: {} disks", white)
 
             if white == black:
                 cprint("Draw")
@@ -309,5 +712,13 @@ class OthelloGame(object):
                 cprint("Black wins")
                 child_return_pipe.send(State.black)
 
-        self.ui.run(mainloop)
+        def run():
+            try:
+                mainloop()
+            finally:
+                for worker in self.workers:
+                    if worker is not None:
+                        worker.stop()
+
+        self.ui.run(run)
         return parent_return_pipe.recv()
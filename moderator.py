@@ -2,8 +2,14 @@
 # Ethan Lowman, 2014
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
+import pkgutil
 import sys
-from game import OthelloGame, State
+from game import BitBoard, OthelloBoard, OthelloGame, State, silence
+import players
+from players.Human import Human
 
 
 def has_tkinter():
@@ -15,6 +21,97 @@ def has_tkinter():
         return True
 
 
+def discover_players():
+    found = {}
+    for _, name, _ in pkgutil.iter_modules(players.__path__):
+        try:
+            module = __import__("players." + name, fromlist=[name])
+        except (ImportError, OSError) as e:
+            print("Skipping player '{}': {}".format(name, e))
+            continue
+
+        player = getattr(module, name, None)
+        if isinstance(player, type) and issubclass(player, players.Player) \
+           and player is not Human:
+            found[name] = player
+    return found
+
+
+def play_match(match):
+    from ui.null import NullUI
+
+    name_1, name_2, timeout, board_type, ponder = match
+    found = discover_players()
+    game = OthelloGame(found[name_1], found[name_2], ui=NullUI,
+                       timeout=timeout, board_type=board_type, ponder=ponder)
+    return game.play(silent=True)
+
+
+def run_tournament(names, trials, timeout=None, board_type=None,
+                   ponder=False):
+    matches = [(name_1, name_2, timeout, board_type, ponder)
+               for name_1, name_2 in itertools.permutations(names, 2)
+               for trial in range(trials)]
+
+    standings = {name: [0, 0, 0] for name in names}  # wins, losses, draws
+    with ProcessPoolExecutor(max_workers=os.cpu_count(),
+                             initializer=silence) as executor:
+        results = executor.map(play_match, matches)
+        for (name_1, name_2, _, _, _), result in zip(matches, results):
+            if result is State.black:
+                standings[name_1][0] += 1
+                standings[name_2][1] += 1
+            elif result is State.white:
+                standings[name_2][0] += 1
+                standings[name_1][1] += 1
+            else:
+                standings[name_1][2] += 1
+                standings[name_2][2] += 1
+            print(".", end="", flush=True)
+    print()
+    return standings
+
+
+def print_standings(standings):
+    def points(name):
+        wins, losses, draws = standings[name]
+        return wins + draws / 2
+
+    width = max(len(name) for name in standings) + 2
+    print("Player".ljust(width) + " Games  Wins  Losses  Draws  Points")
+    for name in sorted(standings, key=points, reverse=True):
+        wins, losses, draws = standings[name]
+        print("{}{:6d}{:6d}{:8d}{:7d}{:8.1f}".format(name.ljust(width),
+                                                     wins + losses + draws,
+                                                     wins,
+                                                     losses,
+                                                     draws,
+                                                     points(name)))
+
+
+def print_search_stats(game):
+    """Prints the search statistics the players reported during a game."""
+    print("Player  Moves     Nodes   Nodes/s  Depth  TT hits  1st cut  "
+          "Time (s)")
+    for player in (State.black, State.white):
+        entries = [entry for entry in game.record
+                   if entry["player"] is player and entry["stats"]]
+        if not entries:
+            continue
+        nodes = sum(entry["stats"]["nodes"] for entry in entries)
+        probes = sum(entry["stats"]["tt_probes"] for entry in entries)
+        hits = sum(entry["stats"]["tt_hits"] for entry in entries)
+        cutoffs = sum(entry["stats"]["cutoffs"] for entry in entries)
+        first = sum(entry["stats"]["first_move_cutoffs"] for entry in entries)
+        elapsed = sum(entry["stats"]["time"] for entry in entries)
+        depth = sum(entry["stats"]["depth"] for entry in entries)
+        print("{:6}{:7d}{:10d}{:10.0f}{:7.1f}{:9.0%}{:9.0%}{:10.1f}".format(
+            State.player_name(player), len(entries), nodes,
+            nodes / elapsed if elapsed else 0, depth / len(entries),
+            hits / probes if probes else 0,
+            first / cutoffs if cutoffs else 0, elapsed))
+
+
 def main(argv):
     parser = argparse.ArgumentParser(description="Othello Moderator")
     ui_group = parser.add_mutually_exclusive_group(required=False)
@@ -31,6 +128,12 @@ def main(argv):
         action="store_true",
         help="Use a text-based UI"
     )
+    ui_group.add_argument(
+        "-H",
+        "--headless",
+        action="store_true",
+        help="Do not display the game, only the result"
+    )
 
     parser.add_argument(
         "-n",
@@ -40,6 +143,13 @@ def main(argv):
              "robin tournament."
     )
 
+    parser.add_argument(
+        "-b",
+        "--bitboard",
+        action="store_true",
+        help="Use the bitboard implementation of the game board"
+    )
+
     parser.add_argument(
         "-T",
         "--timeout",
@@ -47,23 +157,48 @@ def main(argv):
         help="The maximum amount of time (seconds) to allow AIs for each move."
     )
 
+    parser.add_argument(
+        "-p",
+        "--ponder",
+        action="store_true",
+        help="Let AIs search during their opponent's turn"
+    )
+
+    parser.add_argument(
+        "-s",
+        "--stats",
+        action="store_true",
+        help="Print the players' search statistics after the game"
+    )
+
     parser.add_argument("players", nargs="*")
 
     args = parser.parse_args(argv)
 
-    if not args.graphical and not args.terminal:
+    if not args.graphical and not args.terminal and not args.headless:
         args.graphical = True
 
-    if has_tkinter() and args.graphical:
+    if args.headless:
+        from ui.null import NullUI
+        ui = NullUI
+    elif has_tkinter() and args.graphical:
         from ui.gui import GraphicalUI
         ui = GraphicalUI
     else:
         from ui.terminal import TerminalUI
         ui = TerminalUI
 
+    board_type = BitBoard if args.bitboard else OthelloBoard
+
     players = args.players
     if len(players) == 0:
-        print("Running tournament...")
+        names = sorted(discover_players())
+        print("Running tournament between {}...".format(", ".join(names)))
+        standings = run_tournament(names, args.repeated_trials or 1,
+                                   timeout=args.timeout,
+                                   board_type=board_type,
+                                   ponder=args.ponder)
+        print_standings(standings)
 
     elif len(players) == 2:
         try:
@@ -88,8 +223,20 @@ def main(argv):
             else:
                 raise e
 
-        game = OthelloGame(player_1, player_2, ui=ui, timeout=args.timeout)
-        game.play()
+        game = OthelloGame(player_1, player_2, ui=ui, timeout=args.timeout,
+                           board_type=board_type, ponder=args.ponder)
+        if args.headless:
+            result = game.play(silent=True)
+            print("Black:", game.board.count(State.black), "disks")
+            print("White:", game.board.count(State.white), "disks")
+            if result is State.draw:
+                print("Draw")
+            else:
+                print(State.player_name(result).capitalize(), "wins")
+        else:
+            game.play()
+        if args.stats:
+            print_search_stats(game)
     else:
         print("Provide the names of two players as arguments or provide "
               "no names to run a tournament.")
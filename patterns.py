@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""Pattern evaluation: lookup tables over lines, edges and corner regions of
+the board, indexed by the base 3 code of the squares they cover and trained
+on self-play positions. The tables are stored in a binary file read by both
+the Python and the C players.
+
+The file starts with a header (magic, number of phases, number of patterns,
+scale), then for each pattern its size, its number of instances and the
+squares of every instance, then one little-endian int16 table of 3 ** size
+entries per pattern and phase, phase by phase. Entries are the predicted
+final disk difference (black minus white) times the scale; a position scores
+the sum of the entries of every instance for its phase, the number of disks
+on the board grouped into equal bands. Instances of a pattern are its
+rotations and reflections and share its table, which is kept symmetric so
+that symmetric positions score the same."""
+
+import argparse
+from array import array
+import os
+import struct
+import sys
+
+from game import State, transform
+
+PATTERN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "patterns.bin")
+
+MAGIC = b"OTHPATT1"
+HEADER = struct.Struct("<8sHHf")    # magic, phases, patterns, scale
+PATTERN = struct.Struct("<BB")      # squares, instances
+
+# Table entries per disk of predicted disk difference
+SCALE = 256
+
+# Base patterns as squares (row * 8 + col). The digit of the square at
+# position k is multiplied by 3 ** k, counting empty as 0, black as 1 and
+# white as 2.
+BASE_PATTERNS = (
+    ("edge2x", (9, 0, 1, 2, 3, 4, 5, 6, 7, 14)),
+    ("corner3x3", (0, 1, 2, 8, 9, 10, 16, 17, 18)),
+    ("corner2x5", (0, 1, 2, 3, 4, 8, 9, 10, 11, 12)),
+    ("hv2", (8, 9, 10, 11, 12, 13, 14, 15)),
+    ("hv3", (16, 17, 18, 19, 20, 21, 22, 23)),
+    ("hv4", (24, 25, 26, 27, 28, 29, 30, 31)),
+    ("diag8", (0, 9, 18, 27, 36, 45, 54, 63)),
+    ("diag7", (1, 10, 19, 28, 37, 46, 55)),
+    ("diag6", (2, 11, 20, 29, 38, 47)),
+    ("diag5", (3, 12, 21, 30, 39)),
+    ("diag4", (4, 13, 22, 31)),
+)
+
+
+def transform_squares(t, squares):
+    return tuple(transform(t, 1 << square).bit_length() - 1
+                 for square in squares)
+
+
+def symmetric_instances(squares):
+    """Returns the distinct images of a pattern under the eight symmetries,
+    keeping the order of its squares."""
+    instances = []
+    seen = set()
+    for t in range(8):
+        image = transform_squares(t, squares)
+        if frozenset(image) not in seen:
+            seen.add(frozenset(image))
+            instances.append(image)
+    return tuple(instances)
+
+
+def self_symmetries(squares):
+    """Returns the symmetries that map a pattern onto its own squares, as
+    the position each position of the pattern moves to. An instance is read
+    in one order only, so its table must give every one of these orders the
+    same value for scores not to depend on the orientation of the board."""
+    permutations = []
+    for t in range(8):
+        image = transform_squares(t, squares)
+        if set(image) == set(squares):
+            permutation = tuple(squares.index(square) for square in image)
+            if permutation not in permutations:
+                permutations.append(permutation)
+    return tuple(permutations)
+
+
+def permuted_indices(permutation):
+    """Returns the index that each table index becomes when the digit at
+    position k moves to position permutation[k]."""
+    result = [0]
+    for position in permutation:
+        power = 3 ** position
+        result = [index + digit * power for digit in range(3)
+                  for index in result]
+    return result
+
+
+# (name, size, instances) for every pattern
+PATTERNS = tuple((name, len(squares), symmetric_instances(squares))
+                 for name, squares in BASE_PATTERNS)
+PATTERN_SYMMETRIES = tuple(self_symmetries(squares)
+                           for name, squares in BASE_PATTERNS)
+# Pattern number and squares of every instance, over all patterns
+INSTANCES = tuple((number, squares)
+                  for number, (name, size, instances) in enumerate(PATTERNS)
+                  for squares in instances)
+INSTANCE_PATTERNS = tuple(number for number, squares in INSTANCES)
+# (instance, 3 ** position) for each instance covering each square
+SQUARE_INSTANCES = tuple(
+    tuple((instance, 3 ** squares.index(square))
+          for instance, (number, squares) in enumerate(INSTANCES)
+          if square in squares)
+    for square in range(64))
+
+
+def phase(disks, phases):
+    return (disks - 4) * phases // 61
+
+
+def indices(cells):
+    """Returns the index of every instance for a list of 64 states."""
+    return [sum(cells[square] * 3 ** k for k, square in enumerate(squares))
+            for number, squares in INSTANCES]
+
+
+class PatternTables(object):
+
+    def __init__(self, path=PATTERN_PATH, phases=1, scale=SCALE):
+        """Loads the tables at path, or makes empty tables with the given
+        number of phases if path is None."""
+        if path is None:
+            self.phases = phases
+            self.scale = scale
+            self.tables = [[array("h", bytes(2 * 3 ** size))
+                            for name, size, instances in PATTERNS]
+                           for p in range(phases)]
+            return
+
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, self.phases, count, self.scale = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise Exception("'{}' is not a pattern file".format(path))
+        offset = HEADER.size
+        patterns = []
+        for i in range(count):
+            size, instances = PATTERN.unpack_from(data, offset)
+            offset += PATTERN.size
+            patterns.append((size, tuple(
+                tuple(data[offset + j * size:offset + (j + 1) * size])
+                for j in range(instances))))
+            offset += size * instances
+        if patterns != [(size, instances)
+                        for name, size, instances in PATTERNS]:
+            raise Exception("'{}' has different patterns".format(path))
+        if len(data) != offset + 2 * self.phases * sum(
+                3 ** size for name, size, instances in PATTERNS):
+            raise Exception("'{}' is truncated".format(path))
+
+        self.tables = []
+        for p in range(self.phases):
+            tables = []
+            for name, size, instances in PATTERNS:
+                table = array("h")
+                table.frombytes(data[offset:offset + 2 * 3 ** size])
+                if sys.byteorder != "little":
+                    table.byteswap()
+                tables.append(table)
+                offset += 2 * 3 ** size
+            self.tables.append(tables)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, self.phases, len(PATTERNS),
+                                self.scale))
+            for name, size, instances in PATTERNS:
+                f.write(PATTERN.pack(size, len(instances)))
+                for squares in instances:
+                    f.write(bytes(squares))
+            for tables in self.tables:
+                for table in tables:
+                    if sys.byteorder != "little":
+                        table = array("h", table)
+                        table.byteswap()
+                    table.tofile(f)
+
+    def symmetrize(self):
+        """Averages every entry over the readings of its pattern by the
+        symmetries that keep its squares (see self_symmetries)."""
+        for number, permutations in enumerate(PATTERN_SYMMETRIES):
+            if len(permutations) == 1:
+                continue
+            permuted = [permuted_indices(permutation)
+                        for permutation in permutations]
+            for tables in self.tables:
+                table = tables[number]
+                tables[number] = array("h", (
+                    round(sum(table[p[index]] for p in permuted) /
+                          len(permuted))
+                    for index in range(len(table))))
+
+    def score(self, indices, disks):
+        """Scores the instance indices of a position with disks disks, from
+        black's point of view."""
+        tables = self.tables[phase(disks, self.phases)]
+        return sum(tables[number][index] for number, index
+                   in zip(INSTANCE_PATTERNS, indices)) / self.scale
+
+    def evaluate(self, board):
+        return self.score(indices([board[square >> 3][square & 7]
+                                   for square in range(64)]),
+                          board.total_count())
+
+
+class PatternEvaluator(object):
+    """Scores positions with pattern tables, keeping the index of every
+    instance up to date from the flips of each move. Has the same interface
+    as players.AI.Evaluator."""
+
+    def __init__(self, board, tables):
+        self.tables = tables
+        self.indices = indices([board[square >> 3][square & 7]
+                                for square in range(64)])
+        self.stack = []
+
+    def push(self, square, player, flipped):
+        instance_indices = self.indices
+        # A flip turns a 2 digit into a 1 for black and the reverse for white
+        flip = -1 if player is State.black else 1
+        for instance, power in SQUARE_INSTANCES[square]:
+            instance_indices[instance] += player * power
+        for f in flipped:
+            for instance, power in SQUARE_INSTANCES[f]:
+                instance_indices[instance] += flip * power
+        self.stack.append((square, player, flipped))
+
+    def pop(self):
+        square, player, flipped = self.stack.pop()
+        instance_indices = self.indices
+        flip = -1 if player is State.black else 1
+        for instance, power in SQUARE_INSTANCES[square]:
+            instance_indices[instance] -= player * power
+        for f in flipped:
+            for instance, power in SQUARE_INSTANCES[f]:
+                instance_indices[instance] -= flip * power
+
+    def evaluate(self, board):
+        return self.tables.score(self.indices, board.total_count())
+
+
+def batch_indices(black, white):
+    """Returns the N x instances array of indices for arrays of black and
+    white bitboards (requires NumPy)."""
+    import numpy as np
+
+    boards = np.stack((black, white), axis=1).astype("<u8")
+    bits = np.unpackbits(boards.view(np.uint8).reshape(len(boards), 2, 8),
+                         axis=2, bitorder="little")
+    # An extra always empty square pads the shorter patterns
+    digits = np.zeros((len(boards), 65), dtype=np.int64)
+    digits[:, :64] = bits[:, 0] + 2 * bits[:, 1]
+    longest = max(size for name, size, instances in PATTERNS)
+    squares = np.full((len(INSTANCES), longest), 64)
+    for instance, (number, pattern) in enumerate(INSTANCES):
+        squares[instance, :len(pattern)] = pattern
+    powers = 3 ** np.arange(longest)
+    return digits[:, squares] @ powers
+
+
+def train(path, phases=4, epochs=20, rate=0.02, smoothing=4.0, holdout=10,
+          log=None):
+    """Fits pattern tables to the final results of the positions in a
+    selfplay.py dataset by stochastic gradient descent, one block at a time.
+    Each entry's step is its summed error over the block divided by the
+    number of times it occurs, so rare configurations move less. Returns
+    the tables and the RMS error on every holdout-th position."""
+    import numpy as np
+    from batch import popcount
+    from selfplay import read_blocks
+
+    sizes = [3 ** size for name, size, instances in PATTERNS]
+    offsets = np.zeros((phases, len(PATTERNS)), dtype=np.int64)
+    total = 0
+    for p in range(phases):
+        for number, size in enumerate(sizes):
+            offsets[p, number] = total
+            total += size
+    weights = np.zeros(total)
+    instance_patterns = np.array(INSTANCE_PATTERNS)
+    symmetries = [(number, np.array([permuted_indices(permutation)
+                                     for permutation in permutations]))
+                  for number, permutations in enumerate(PATTERN_SYMMETRIES)
+                  if len(permutations) > 1]
+
+    def symmetrize():
+        for number, permuted in symmetries:
+            for p in range(phases):
+                start = offsets[p, number]
+                table = weights[start:start + sizes[number]]
+                table[:] = table[permuted].mean(0)
+
+    def entries(block):
+        black = np.frombuffer(block["black"], dtype=np.uint64)
+        white = np.frombuffer(block["white"], dtype=np.uint64)
+        disks = popcount(black | white)
+        flat = batch_indices(black, white) + \
+            offsets[phase(disks, phases)[:, None], instance_patterns]
+        y = np.frombuffer(block["result"], dtype=np.int8).astype(np.float64)
+        validation = np.zeros(len(y), dtype=bool)
+        if holdout:
+            validation[::holdout] = True
+        return flat, y, validation
+
+    error = None
+    for epoch in range(epochs):
+        squared = count = 0
+        for block in read_blocks(path):
+            flat, y, validation = entries(block)
+            residual = y - weights[flat].sum(1)
+            squared += (residual[validation] ** 2).sum()
+            count += validation.sum()
+
+            train_flat = flat[~validation].ravel()
+            train_residual = np.repeat(residual[~validation],
+                                       len(INSTANCES))
+            step = np.bincount(train_flat, weights=train_residual,
+                               minlength=total)
+            seen = np.bincount(train_flat, minlength=total)
+            weights += rate * step / (seen + smoothing)
+        symmetrize()
+        error = (squared / count) ** 0.5 if count else None
+        if log is not None:
+            log(epoch + 1, error)
+
+    tables = PatternTables(None, phases=phases)
+    quantized = np.clip(np.rint(weights * tables.scale), -32767, 32767)
+    for p in range(phases):
+        for number, size in enumerate(sizes):
+            start = offsets[p, number]
+            tables.tables[p][number] = array(
+                "h", quantized[start:start + size].astype(np.int16).tobytes())
+    return tables, error
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Train pattern tables")
+    parser.add_argument("dataset", help="A dataset written by selfplay.py")
+    parser.add_argument("-p", "--phases", type=int, default=4,
+                        help="The number of game phases with their own "
+                             "tables")
+    parser.add_argument("-e", "--epochs", type=int, default=20,
+                        help="The number of passes over the dataset")
+    parser.add_argument("-r", "--rate", type=float, default=0.02,
+                        help="The learning rate")
+    parser.add_argument("-v", "--holdout", type=int, default=10,
+                        help="Keep every nth position back for validation "
+                             "(0 to use every position)")
+    parser.add_argument("-o", "--output",
+                        help="The pattern file to write (the AIs load {})"
+                             .format(os.path.basename(PATTERN_PATH)))
+    args = parser.parse_args(argv)
+
+    def log(epoch, error):
+        if error is not None:
+            print("Epoch {}: validation error {:.3f} disks".format(epoch,
+                                                                  error))
+
+    tables, error = train(args.dataset, phases=args.phases,
+                          epochs=args.epochs, rate=args.rate,
+                          holdout=args.holdout, log=log)
+    print("{:10} {:>8} {:>8} {:>8}".format("Pattern", "Filled", "Min",
+                                           "Max"))
+    for number, (name, size, instances) in enumerate(PATTERNS):
+        entries = [entry for phase_tables in tables.tables
+                   for entry in phase_tables[number]]
+        print("{:10} {:8.1%} {:8.2f} {:8.2f}".format(
+            name, sum(1 for entry in entries if entry) / len(entries),
+            min(entries) / tables.scale, max(entries) / tables.scale))
+
+    if args.output is None:
+        print("Pass -o {} to play with these tables".format(PATTERN_PATH))
+        return
+    tables.save(args.output)
+    print("Wrote", args.output)
+    if os.path.abspath(args.output) == PATTERN_PATH:
+        print("Both AIs now evaluate with these tables; delete the file to go "
+              "back to the heuristics")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
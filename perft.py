@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Counts the leaves of the game tree from the start position to a fixed
+depth with each board backend, to check that they generate exactly the same
+moves (passes included) and to compare their speed."""
+
+import argparse
+import sys
+from time import perf_counter
+
+from game import BitBoard, OthelloBoard, State
+
+# Leaf counts from the start position with a pass counted as a ply and
+# finished games counted as leaves (OEIS A124004)
+KNOWN_COUNTS = (1, 4, 12, 56, 244, 1396, 8200, 55092, 390216, 3005288,
+                24571284, 212258800, 1939886636)
+
+
+def perft(board, player, depth):
+    """Counts the leaves of the game tree to the given depth. A pass is a
+    ply of its own and finished games are leaves."""
+    if depth == 0:
+        return 1
+    moves = board.legal_moves(player)
+    opponent = State.opponent(player)
+    if not moves:
+        if not board.legal_moves(opponent):
+            return 1
+        return perft(board, opponent, depth - 1)
+
+    total = 0
+    for row, col in moves:
+        board.apply(row, col, player)
+        total += perft(board, opponent, depth - 1)
+        board.undo()
+    return total
+
+
+def divide(board, player, depth, count=perft):
+    """Returns {move: leaf count} for each move from the position, to find
+    where two backends disagree."""
+    counts = {}
+    for row, col in board.legal_moves(player):
+        board.apply(row, col, player)
+        counts[(row, col)] = count(board, State.opponent(player), depth - 1)
+        board.undo()
+    return counts
+
+
+def c_perft(board, player, depth):
+    from ctypes import c_int, c_uint64
+    from players.cAI import lib
+
+    lib.perft.restype = c_uint64
+    lib.perft.argtypes = [c_uint64, c_uint64, c_int]
+    own, opp = board.masks(player)
+    return lib.perft(own, opp, depth)
+
+
+# Backend name: (board class, perft function)
+BACKENDS = {"OthelloBoard": (OthelloBoard, perft),
+            "BitBoard": (BitBoard, perft),
+            "C": (BitBoard, c_perft)}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Othello perft")
+    parser.add_argument("-d", "--depth", type=int, default=6,
+                        help="The deepest depth to count")
+    parser.add_argument("-b", "--backend", action="append",
+                        choices=sorted(BACKENDS),
+                        help="A backend to run (default: all of them)")
+    parser.add_argument("-p", "--positions", action="store_true",
+                        help="Also compare the backends on seeded random "
+                             "positions, mostly from the late game")
+    parser.add_argument("--divide", action="store_true",
+                        help="Print the count below each first move at the "
+                             "deepest depth")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for name in args.backend or sorted(BACKENDS):
+        board_type, count = BACKENDS[name]
+        # Load the backend before timing anything
+        count(board_type(), State.black, 0)
+        print(name)
+        print("Depth        Leaves    Time (s)    Leaves/s")
+        for depth in range(1, args.depth + 1):
+            start = perf_counter()
+            leaves = count(board_type(), State.black, depth)
+            elapsed = perf_counter() - start
+
+            note = ""
+            if depth < len(KNOWN_COUNTS):
+                if leaves != KNOWN_COUNTS[depth]:
+                    note = "expected {}".format(KNOWN_COUNTS[depth])
+                    failed = True
+            print("{:5d}{:14d}{:12.3f}{:12.0f}  {}".format(
+                depth, leaves, elapsed,
+                leaves / elapsed if elapsed else 0, note))
+
+        if args.divide:
+            for move, leaves in sorted(divide(board_type(), State.black,
+                                              args.depth, count).items()):
+                print("{}{} {}".format("abcdefgh"[move[1]], move[0] + 1,
+                                       leaves))
+        print()
+
+    if args.positions:
+        from bench.positions import position_set, replay
+
+        names = args.backend or sorted(BACKENDS)
+        # Late positions so that the trees include passes and finished games
+        games = position_set(stages=(24, 40, 52, 56))
+        mismatches = 0
+        for moves in games:
+            counts = {}
+            for name in names:
+                board_type, count = BACKENDS[name]
+                board, player = replay(moves, board_type)
+                counts[name] = count(board, player, args.depth)
+            if len(set(counts.values())) > 1:
+                print("Backends disagree after", " ".join(
+                    "pass" if move is None else
+                    "abcdefgh"[move[1]] + str(move[0] + 1)
+                    for move in moves), counts)
+                mismatches += 1
+        print("Compared {} positions at depth {}, {} mismatches".format(
+            len(games), args.depth, mismatches))
+        failed = failed or mismatches > 0
+
+    if failed:
+        print("Leaf counts do not match")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,26 +1,247 @@
-from . import Player
-from copy import deepcopy
+from . import Player, TimeManager
+import os
+import random
 import sys
 from time import time
 
 sys.path.insert(0, "..")
-from game import OthelloBoard, State
+from book import BOOK_PATH, OpeningBook, position_key
+from endgame import EndgameSolver, SolverTimeout
+from game import OthelloBoard, State, inverse_move, transform_move
+from patterns import PATTERN_PATH, PatternEvaluator, PatternTables
+from tune import WEIGHTS_PATH, load_weights
 
 
 # http://mkorman.org/othello.pdf
 
 
+_random = random.Random(0x07e11001)
+# ZOBRIST[state][square], with all-zero keys for empty squares
+ZOBRIST = [[0] * 64] + [[_random.getrandbits(64) for square in range(64)]
+                        for state in (State.black, State.white)]
+ZOBRIST_FLIP = [ZOBRIST[State.black][square] ^ ZOBRIST[State.white][square]
+                for square in range(64)]
+ZOBRIST_WHITE_TO_MOVE = _random.getrandbits(64)
+
+
+def zobrist_key(board, player):
+    key = ZOBRIST_WHITE_TO_MOVE if player is State.white else 0
+    for row in range(8):
+        cells = board[row]
+        for col in range(8):
+            key ^= ZOBRIST[cells[col]][row * 8 + col]
+    return key
+
+
+def child_key(key, move, player, flipped):
+    key ^= ZOBRIST_WHITE_TO_MOVE ^ ZOBRIST[player][move[0] * 8 + move[1]]
+    for square in flipped:
+        key ^= ZOBRIST_FLIP[square]
+    return key
+
+
+# Weights of the six heuristics, from the file written by tune.py if there is
+# one
+WEIGHTS = load_weights(WEIGHTS_PATH)
+
+DISK_SQUARE_WEIGHTS = (20, -3, 11, 8, 8, 11, -3, 20,
+                       -3, -7, -4, 1, 1, -4, -7, -3,
+                       11, -4, 2, 2, 2, 2, -4, 11,
+                       8, 1, 2, -3, -3, 2, 1, 8,
+                       8, 1, 2, -3, -3, 2, 1, 8,
+                       11, -4, 2, 2, 2, 2, -4, 11,
+                       -3, -7, -4, 1, 1, -4, -7, -3,
+                       20, -3, 11, 8, 8, 11, -3, 20)
+
+NEIGHBOURS = tuple(tuple((row + drow) * 8 + col + dcol
+                         for drow, dcol in OthelloBoard.directions
+                         if 0 <= row + drow <= 7 and 0 <= col + dcol <= 7)
+                   for row in range(8) for col in range(8))
+
+# Each corner with the three squares next to it
+CORNERS = ((0, (1, 9, 8)),
+           (7, (6, 14, 15)),
+           (56, (48, 49, 57)),
+           (63, (62, 54, 55)))
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Evaluator(object):
+    """Scores positions with the same heuristics as AI.evaluate, keeping the
+    disk-square and frontier terms up to date from the flips of each move."""
+
+    def __init__(self, board, weights=WEIGHTS):
+        self.weights = weights
+        self.cells = [board[square >> 3][square & 7] for square in range(64)]
+        self.stack = []
+
+        self.disk_squares = 0
+        for square in range(64):
+            if self.cells[square] is State.black:
+                self.disk_squares += DISK_SQUARE_WEIGHTS[square]
+            elif self.cells[square] is State.white:
+                self.disk_squares -= DISK_SQUARE_WEIGHTS[square]
+
+        # Number of empty squares next to each square, and for each player
+        # the number of (disk, empty neighbour) pairs
+        self.empty_neighbours = [
+            sum(1 for n in NEIGHBOURS[square] if self.cells[n] is State.empty)
+            for square in range(64)
+        ]
+        self.frontier = [0, 0, 0]
+        for square in range(64):
+            self.frontier[self.cells[square]] += \
+                self.empty_neighbours[square]
+
+    def push(self, square, player, flipped):
+        cells = self.cells
+        empty_neighbours = self.empty_neighbours
+        frontier = self.frontier
+        opponent = State.opponent(player)
+        sign = 1 if player is State.black else -1
+
+        self.disk_squares += sign * DISK_SQUARE_WEIGHTS[square]
+        cells[square] = player
+        frontier[player] += empty_neighbours[square]
+        for n in NEIGHBOURS[square]:
+            empty_neighbours[n] -= 1
+            frontier[cells[n]] -= 1
+
+        for f in flipped:
+            self.disk_squares += 2 * sign * DISK_SQUARE_WEIGHTS[f]
+            cells[f] = player
+            frontier[opponent] -= empty_neighbours[f]
+            frontier[player] += empty_neighbours[f]
+
+        self.stack.append((square, player, flipped))
+
+    def pop(self):
+        square, player, flipped = self.stack.pop()
+        cells = self.cells
+        empty_neighbours = self.empty_neighbours
+        frontier = self.frontier
+        opponent = State.opponent(player)
+        sign = 1 if player is State.black else -1
+
+        for f in flipped:
+            self.disk_squares -= 2 * sign * DISK_SQUARE_WEIGHTS[f]
+            cells[f] = opponent
+            frontier[player] -= empty_neighbours[f]
+            frontier[opponent] += empty_neighbours[f]
+
+        for n in NEIGHBOURS[square]:
+            empty_neighbours[n] += 1
+            frontier[cells[n]] += 1
+        frontier[player] -= empty_neighbours[square]
+        cells[square] = State.empty
+        self.disk_squares -= sign * DISK_SQUARE_WEIGHTS[square]
+
+    def evaluate(self, board):
+        cells = self.cells
+
+        # Piece difference
+        B = board.count(State.black)
+        W = board.count(State.white)
+        if B > W:
+            p = 100 * B / (B + W)
+        elif B < W:
+            p = -100 * W / (B + W)
+        else:
+            p = 0
+
+        # Corner occupancy and closeness
+        c = l = 0
+        for corner, adjacent in CORNERS:
+            if cells[corner] is State.black:
+                c += 25
+            elif cells[corner] is State.white:
+                c -= 25
+            else:
+                for square in adjacent:
+                    if cells[square] is State.black:
+                        l -= 12.5
+                    elif cells[square] is State.white:
+                        l += 12.5
+
+        # Mobility
+        B = board.mobility(State.black)
+        W = board.mobility(State.white)
+        if B > W:
+            m = 100 * B / (B + W)
+        elif B < W:
+            m = -100 * W / (B + W)
+        else:
+            m = 0
+
+        # Frontier disks
+        B = self.frontier[State.black]
+        W = self.frontier[State.white]
+        if B > W:
+            f = -100 * B / (B + W)
+        elif B < W:
+            f = 100 * W / (B + W)
+        else:
+            f = 0
+
+        heuristics = (p, c, l, m, f, self.disk_squares)
+        weights = self.weights
+        return sum(weights[i] * heuristics[i] for i in range(len(heuristics)))
+
+
+class TranspositionTable(object):
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+    # Entry layout: (key, depth, bound, score, best move, generation)
+    KEY, DEPTH, BOUND, SCORE, MOVE, GENERATION = range(6)
+
+    def __init__(self, bits=18):
+        self.mask = (1 << bits) - 1
+        self.entries = [None] * (1 << bits)
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+
+    def new_search(self):
+        self.generation += 1
+
+    def probe(self, key):
+        self.probes += 1
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, bound, score, move):
+        index = key & self.mask
+        entry = self.entries[index]
+        # Keep the deeper of two entries from the current search, but always
+        # replace results left over from earlier moves.
+        if entry is None or entry[0] == key or \
+           entry[5] != self.generation or depth >= entry[1]:
+            self.entries[index] = (key, depth, bound, score, move,
+                                   self.generation)
+
+
 class GameState(object):
 
-    def __init__(self, board, parent=None, depth=None, player=None, move=None):
+    def __init__(self, board, parent=None, depth=None, player=None, move=None,
+                 key=None):
         self.board = board
         self.children = {}
         self.depth = depth
         self.parent = parent
         self.player = player
         self.move = move
-        self.hash = None
+        self.hash = key
         self.score = 0
+        # Best child so far, replaced only by a strictly better score
+        self.best_move = None
 
     def __eq__(self, other):
         return hash(self) == hash(other)
@@ -28,8 +249,7 @@ class GameState(object):
     def __hash__(self):
         if self.hash is not None:
             return self.hash
-        s = "".join("".join(map(str, row)) for row in self.board.board)
-        self.hash = hash(s)
+        self.hash = zobrist_key(self.board, State.opponent(self.player))
         return self.hash
 
     def __repr__(self):
@@ -38,10 +258,46 @@ class GameState(object):
 
 
 class AI(Player):
+    # When set, every incremental evaluation is checked against evaluate
+    debug = False
+    # When set, the children of nodes one ply above the leaves are scored
+    # together with batch.evaluate (requires NumPy)
+    batch_leaves = False
+    # Weights of the six heuristics in evaluate
+    weights = WEIGHTS
+    # Positions with at most this many empty squares are solved exactly
+    endgame_empties = 12
+    # Opening book to play from, if the file exists
+    book_path = BOOK_PATH
+    # Pattern tables to evaluate with instead of the heuristics, if the file
+    # exists
+    pattern_path = PATTERN_PATH
+    # Deepest iteration of the search, or None to search until time runs out
+    max_depth = None
+    # Positions with at most this many disks share transposition table
+    # entries with their rotations and reflections
+    canonical_disks = 20
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.max_time -= 1
+        # Position searched during the opponent's last turn, as masks
+        self.pondered = None
+        self.pondering = False
+        self.book = None
+        if self.book_path is not None and os.path.exists(self.book_path):
+            self.book = OpeningBook(self.book_path)
+        self.patterns = None
+        if self.pattern_path is not None and \
+           os.path.exists(self.pattern_path):
+            self.patterns = PatternTables(self.pattern_path)
+        # Kept on the player so results carry over between moves of a game
+        self.table = TranspositionTable()
+        # Move ordering state: killer moves per ply and history scores per
+        # player and square
+        self.killers = [[None, None] for ply in range(64)]
+        self.history = [None, [0] * 64, [0] * 64]
+        self.plies = 0
+        self.interior_nodes = self.cutoffs = self.first_move_cutoffs = 0
 
     def evaluate(self, state):
         # state.score = state.board.count(State.black) - state.board.count(State.white)
@@ -140,14 +396,350 @@ class AI(Player):
                     total += V[row][col] * sigma
             return total
 
-        weights = (10, 801.724, 382.026, 78.922, 74.396, 10)
         heuristics = (p(), c(), l(), m(), f(), d())
+        weights = self.weights
         score = sum(weights[i] * heuristics[i] for i in range(len(heuristics)))
         state.score = score
         return score
 
+    def order_moves(self, moves, player, ply, best_move):
+        # Hash move first, then killer moves, then by history score
+        killers = self.killers[ply]
+        history = self.history[player]
+        moves.sort(key=lambda move: (move == best_move,
+                                     move in killers,
+                                     history[move[0] * 8 + move[1]]),
+                   reverse=True)
+
+    def record_cutoff(self, move, player, depth, ply, index):
+        self.cutoffs += 1
+        if index == 0:
+            self.first_move_cutoffs += 1
+
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        self.history[player][move[0] * 8 + move[1]] += depth * depth
+
+    def search_leaves(self, board, player, moves):
+        import batch
+
+        cells = []
+        for move in moves:
+            flipped = board.apply(move[0], move[1], player)
+            self.evaluator.push(move[0] * 8 + move[1], player, flipped)
+            cells.append(list(self.evaluator.cells))
+            self.evaluator.pop()
+            board.undo()
+
+        scores = batch.evaluate(cells, self.weights).tolist()
+        # Count the leaves as the search would have visited them
+        self.nodes += len(moves)
+        if player is State.black:
+            return max(zip(scores, moves))
+        return min(zip(scores, moves))
+
+    def table_key(self, board, player, key):
+        """Returns the transposition table key for a position and the
+        transform that maps its moves onto the stored ones."""
+        if board.total_count() > self.canonical_disks:
+            return key, 0
+        own, opp, t = board.canonical(player)
+        key = position_key(own, opp)
+        if player is State.white:
+            key ^= ZOBRIST_WHITE_TO_MOVE
+        return key, t
+
+    def search(self, board, player, depth, alpha, beta, key):
+        self.nodes += 1
+        if self.clock.expired(self.nodes):
+            raise SearchTimeout()
+
+        best_move = None
+        table_key, t = self.table_key(board, player, key)
+        entry = self.table.probe(table_key)
+        if entry is not None:
+            best_move = entry[TranspositionTable.MOVE]
+            if best_move is not None:
+                best_move = inverse_move(t, best_move)
+            if entry[TranspositionTable.DEPTH] >= depth:
+                score = entry[TranspositionTable.SCORE]
+                bound = entry[TranspositionTable.BOUND]
+                if bound is TranspositionTable.EXACT:
+                    return score
+                elif bound is TranspositionTable.LOWER:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+
+        moves = board.legal_moves(player)
+        if depth == 0 or len(moves) == 0:
+            score = self.evaluator.evaluate(board)
+            if self.debug:
+                if self.patterns is not None:
+                    full = self.patterns.evaluate(board)
+                else:
+                    full = self.evaluate(GameState(
+                        board, player=State.opponent(player), key=key))
+                if abs(full - score) > 1e-6:
+                    raise Exception("Incremental evaluation {} does not "
+                                    "match full evaluation {}"
+                                    .format(score, full))
+            return score
+
+        # Batches are scored with the heuristics, not the pattern tables
+        if depth == 1 and self.batch_leaves and self.patterns is None:
+            score, best_move = self.search_leaves(board, player, moves)
+            self.table.store(table_key, depth, TranspositionTable.EXACT,
+                             score, transform_move(t, best_move))
+            return score
+
+        ply = self.plies - depth
+        self.order_moves(moves, player, ply, best_move)
+        self.interior_nodes += 1
+
+        original_alpha, original_beta = alpha, beta
+        maximizing = player is State.black
+        best_score = float("-inf") if maximizing else float("inf")
+        opponent = State.opponent(player)
+        for index, move in enumerate(moves):
+            flipped = board.apply(move[0], move[1], player)
+            self.evaluator.push(move[0] * 8 + move[1], player, flipped)
+            next_key = child_key(key, move, player, flipped)
+            try:
+                score = self.search(board, opponent, depth - 1,
+                                    alpha, beta, next_key)
+            finally:
+                self.evaluator.pop()
+                board.undo()
+
+            if maximizing:
+                if score > best_score:
+                    best_score, best_move = score, move
+                alpha = max(alpha, score)
+            else:
+                if score < best_score:
+                    best_score, best_move = score, move
+                beta = min(beta, score)
+
+            if alpha >= beta:
+                self.record_cutoff(move, player, depth, ply, index)
+                break
+
+        if best_score <= original_alpha:
+            bound = TranspositionTable.UPPER
+        elif best_score >= original_beta:
+            bound = TranspositionTable.LOWER
+        else:
+            bound = TranspositionTable.EXACT
+        self.table.store(table_key, depth, bound, best_score,
+                         transform_move(t, best_move))
+        return best_score
+
+    def search_root(self, board, plies, previous_state=None):
+        self.plies = plies
+        key = zobrist_key(board, self.color)
+        current_state = GameState(board, depth=0,
+                                  player=State.opponent(self.color), key=key)
+        # Children are added as they finish, so an interrupted iteration
+        # leaves its finished root moves here
+        self.partial_state = current_state
+
+        moves = board.legal_moves(self.color)
+        if previous_state is not None:
+            # Principal variation first, using the previous pass' scores
+            children = previous_state.children
+            moves.sort(key=lambda move: children[move].score,
+                       reverse=self.color is State.black)
+            # Ties keep the previous best first, as partial_move expects
+            moves.remove(previous_state.best_move)
+            moves.insert(0, previous_state.best_move)
+        else:
+            table_key, t = self.table_key(board, self.color, key)
+            entry = self.table.probe(table_key)
+            best_move = entry and entry[TranspositionTable.MOVE]
+            if best_move is not None:
+                best_move = inverse_move(t, best_move)
+            self.order_moves(moves, self.color, 0, best_move)
+
+        alpha, beta = float("-inf"), float("inf")
+        opponent = State.opponent(self.color)
+        for move in moves:
+            flipped = board.apply(move[0], move[1], self.color)
+            self.evaluator.push(move[0] * 8 + move[1], self.color, flipped)
+            next_key = child_key(key, move, self.color, flipped)
+            next_state = GameState(board,
+                                   parent=current_state,
+                                   player=self.color,
+                                   depth=1,
+                                   move=move,
+                                   key=next_key)
+            try:
+                next_state.score = self.search(board, opponent, plies - 1,
+                                               alpha, beta, next_key)
+            finally:
+                self.evaluator.pop()
+                board.undo()
+
+            # Later moves that fail low can tie the best score with a bound,
+            # so only a strict improvement replaces the best move
+            if self.color is State.black:
+                if current_state.best_move is None or \
+                   next_state.score > current_state.score:
+                    current_state.score = next_state.score
+                    current_state.best_move = move
+                alpha = max(alpha, next_state.score)
+            else:
+                if current_state.best_move is None or \
+                   next_state.score < current_state.score:
+                    current_state.score = next_state.score
+                    current_state.best_move = move
+                beta = min(beta, next_state.score)
+            current_state.children[move] = next_state
+
+        return current_state
+
+    def solve_endgame(self, board):
+        # Give the exact solver half of the budget and fall back to the
+        # heuristic search if it does not finish
+        clock = self.clock
+        solver = EndgameSolver(deadline=clock.start +
+                               (clock.hard - clock.start) / 2)
+        own, opp = board.masks(self.color)
+        try:
+            score, move = solver.best_move(own, opp)
+        except SolverTimeout:
+            self.nodes += solver.nodes
+            print("Endgame solver timed out after {} nodes"
+                  .format(solver.nodes))
+            return None
+
+        self.nodes += solver.nodes
+        if move is not None:
+            s = "abcdefgh"[move[1]] + str(move[0] + 1)
+            print("Solved endgame and got {} ({:+d} disks, {} nodes)"
+                  .format(s, score, solver.nodes))
+        return move
+
+    def partial_move(self, best_move):
+        """Returns the best finished root move of an interrupted iteration,
+        as long as it got through the previous best move, which is searched
+        first. The other finished moves only score above it if they are
+        better at the new depth."""
+        children = self.partial_state.children
+        if best_move not in children:
+            return best_move
+
+        move = self.partial_state.best_move
+        self.score = self.partial_state.score
+        if not self.pondering:
+            print("Kept {} of the unfinished ply ({} of {} moves searched)"
+                  .format("abcdefgh"[move[1]] + str(move[0] + 1),
+                          len(children),
+                          len(self.partial_state.board.legal_moves(
+                              self.color))))
+        return move
+
+    def reset_counters(self):
+        self.nodes = self.interior_nodes = self.depth = 0
+        self.cutoffs = self.first_move_cutoffs = 0
+        # Score of the chosen move from the heuristic search
+        self.score = None
+
     def move(self, board):
-        start_time = time()
+        self.clock = TimeManager(self.max_time, 64 - board.total_count())
+        self.source = "search"
+        ponder_hit = self.pondered == board.masks(State.black)
+        self.pondered = None
+        self.reset_counters()
+        probes, hits = self.table.probes, self.table.hits
+
+        move = self.find_move(board)
+
+        elapsed = self.clock.elapsed()
+        probes = self.table.probes - probes
+        hits = self.table.hits - hits
+        self.stats = {"source": self.source,
+                      "nodes": self.nodes,
+                      "nps": self.nodes / elapsed if elapsed else 0.0,
+                      "depth": self.depth,
+                      "score": self.score,
+                      "time": elapsed,
+                      "ply_times": self.clock.ply_times,
+                      "tt_probes": probes,
+                      "tt_hits": hits,
+                      "tt_hit_rate": hits / probes if probes else 0.0,
+                      "cutoffs": self.cutoffs,
+                      "first_move_cutoffs": self.first_move_cutoffs,
+                      "ponder_hit": ponder_hit}
+        return move
+
+    def ponder(self, board, stop):
+        """Searches the position after the opponent's expected reply, taken
+        from the transposition table, so that the next move finds it
+        there."""
+        if 64 - board.total_count() <= self.endgame_empties + 1:
+            return
+
+        opponent = State.opponent(self.color)
+        replies = board.legal_moves(opponent)
+        if replies:
+            table_key, t = self.table_key(board, opponent,
+                                          zobrist_key(board, opponent))
+            entry = self.table.probe(table_key)
+            if entry is None or entry[TranspositionTable.MOVE] is None:
+                return
+            reply = inverse_move(t, entry[TranspositionTable.MOVE])
+            if reply not in replies:
+                return
+            board.make_move(reply[0], reply[1], opponent)
+        if not board.legal_moves(self.color):
+            return
+
+        self.clock = TimeManager(float("inf"), 64 - board.total_count(),
+                                 stop=stop)
+        self.reset_counters()
+        self.pondered = board.masks(State.black)
+        self.pondering = True
+        try:
+            self.iterate(board)
+        finally:
+            self.pondering = False
+
+    def find_move(self, board):
+        if self.book is not None:
+            move = self.book.lookup(board, self.color)
+            if move is not None:
+                s = "abcdefgh"[move[1]] + str(move[0] + 1)
+                print("Book move {}".format(s))
+                self.source = "book"
+                return move
+
+        if 64 - board.total_count() <= self.endgame_empties:
+            move = self.solve_endgame(board)
+            if move is not None:
+                self.source = "endgame"
+                self.depth = 64 - board.total_count()
+                return move
+
+        return self.iterate(board)
+
+    def iterate(self, board):
+        """Iterative deepening search, returning the best move found before
+        the clock runs out."""
+        self.table.new_search()
+        if self.patterns is not None:
+            self.evaluator = PatternEvaluator(board, self.patterns)
+        else:
+            self.evaluator = Evaluator(board, self.weights)
+        self.killers = [[None, None] for ply in range(64)]
+        for history in self.history[1:]:
+            for square in range(64):
+                history[square] //= 2
+        current_state = None
         best_move = None
 
         plies = 0
@@ -156,64 +748,41 @@ class AI(Player):
         while True:
             plies += 1
 
-            if plies > max_plies or (time() - start_time) >= self.max_time:
+            if plies > max_plies or \
+               (self.max_depth is not None and plies > self.max_depth) or \
+               not self.clock.can_start_ply():
                 return best_move
 
-            def search(state, alpha, beta):
-                if (time() - start_time) >= self.max_time:
-                    return -1
-
-                player = State.opponent(state.player)
-                moves = state.board.legal_moves(player)
-
-                if state.depth == plies or len(moves) == 0:
-                    self.evaluate(state)
-                else:
-                    for move in moves:
-                        next_board = deepcopy(state.board)
-                        next_board.make_move(move[0], move[1], player)
-                        next_state = GameState(next_board,
-                                               parent=state,
-                                               player=player,
-                                               depth=state.depth+1,
-                                               move=move)
-                        ret = search(next_state, alpha, beta)
-                        if ret == -1:
-                            return ret
-
-                        if state.player is State.black:
-                            alpha = max(alpha, next_state.score)
-                            state.score = alpha
-                        else:
-                            beta = min(beta, next_state.score)
-                            state.score = beta
-
-                        if alpha >= beta:
-                            break
-
-                        state.children[move] = next_state
-
-            initial_player = State.opponent(self.color)
-            current_state = GameState(board, depth=0, player=initial_player)
-            ret = search(current_state, float("-inf"), float("inf"))
-
-            if ret == -1:
-                return best_move
+            ply_start = time()
+            try:
+                current_state = self.search_root(board, plies, current_state)
+            except SearchTimeout:
+                return self.partial_move(best_move)
 
-            scores = [(s.score, m) for m, s in current_state.children.items()]
-
-            if len(scores) == 0:
+            if current_state.best_move is None:
                 # pass
                 return None
 
-            if self.color is State.black:
-                best_score, best_move = max(scores)
-            else:
-                best_score, best_move = min(scores)
+            best_score = current_state.score
+            best_move = current_state.best_move
+            self.clock.finished_ply(time() - ply_start)
+            self.depth = plies
+            self.score = best_score
+
+            table_key, t = self.table_key(board, self.color,
+                                          current_state.hash)
+            self.table.store(table_key, plies, TranspositionTable.EXACT,
+                             best_score, transform_move(t, best_move))
 
+            if self.pondering:
+                continue
             s = "abcdefgh"[best_move[1]] + str(best_move[0] + 1)
             print("Searched {} plies and got {} ({})".format(plies,
                                                              s,
                                                              best_score))
+            if self.cutoffs:
+                print("Cut off {:.0%} of nodes, {:.0%} on the first "
+                      "move".format(self.cutoffs / self.interior_nodes,
+                                    self.first_move_cutoffs / self.cutoffs))
 
         return best_move
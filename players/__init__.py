@@ -1,9 +1,89 @@
+from time import time
+
+
 class Player(object):
 
     def __init__(self, color, get_user_move, max_time):
         self.color = color
         self.get_user_move = get_user_move
         self.max_time = max_time
+        # Statistics about the last move, filled in by players that search
+        self.stats = {}
 
     def move(self, board):
         raise Exception("Method 'move' not implemented")
+
+    def ponder(self, board, stop):
+        """Called with the position after this player's move while the
+        opponent thinks. Players that can use the time override this and
+        return soon after stop() becomes true."""
+        pass
+
+
+class TimeManager(object):
+    """Budgets the time for one move of an iterative deepening search.
+
+    The hard deadline is the move's time limit less a small margin for
+    sending the move back to the game; a search still running then is
+    aborted. The soft deadline depends on the game phase, and no iteration
+    is started after it or when the previous iterations predict that not
+    even its first root move would finish before the hard deadline. Players
+    keep the finished root moves of an interrupted iteration, so one that
+    gets through its first move still improves the result."""
+
+    # Seconds kept back for passing the move between processes
+    margin = 0.2
+    # Share of the budget to use by number of empty squares. Early moves are
+    # cheap to search deeply and rarely change with another ply.
+    phases = ((50, 0.5), (40, 0.8), (-1, 1.0))
+    # Search nodes between clock checks; must be a power of two
+    check_interval = 256
+    # Bounds on the estimated growth in time from one iteration to the next
+    min_branching = 1.5
+    max_branching = 8.0
+    # Share of an iteration spent on its first root move
+    first_move_share = 0.5
+
+    def __init__(self, max_time, empties, stop=None):
+        self.start = time()
+        # Called with the clock checks to end the search early, if given
+        self.stop = stop
+        budget = max(max_time - self.margin, 0.0)
+        share = next(share for empty, share in self.phases
+                     if empties > empty)
+        self.hard = self.start + budget
+        self.soft = self.start + budget * share
+        self.ply_times = []
+
+    def elapsed(self):
+        return time() - self.start
+
+    def remaining(self):
+        return self.hard - time()
+
+    def expired(self, nodes):
+        """Checks the clock every check_interval nodes."""
+        if nodes & (self.check_interval - 1):
+            return False
+        return time() >= self.hard or \
+            (self.stop is not None and self.stop())
+
+    def branching(self):
+        if len(self.ply_times) < 2 or self.ply_times[-2] <= 0:
+            return self.max_branching / 2
+        return min(max(self.ply_times[-1] / self.ply_times[-2],
+                       self.min_branching), self.max_branching)
+
+    def finished_ply(self, seconds):
+        self.ply_times.append(seconds)
+
+    def can_start_ply(self):
+        """Whether another iteration should be started, predicting its time
+        from the last one and the growth between the last two."""
+        now = time()
+        if now >= self.soft or (self.stop is not None and self.stop()):
+            return False
+        if not self.ply_times:
+            return True
+        predicted = self.ply_times[-1] * self.branching()
+        return now + predicted * self.first_move_share <= self.hard
@@ -1,25 +1,175 @@
-from . import Player
+from . import Player, TimeManager
 from ctypes import *
+import math
 import sys
 import os
+import threading
 from os.path import dirname, abspath
 
 othello_dir = os.path.join(dirname(dirname(abspath(__file__))),
                            "othello")
 sys.path.insert(0, othello_dir)
-from game import State
+from book import BOOK_PATH
+from game import BitBoard, State
+from patterns import PATTERN_PATH
+from tune import FEATURES, WEIGHTS_PATH, load_weights
 
 lib = cdll.LoadLibrary("./players/cAI/cAI.so")
+lib.findMoveBitboards.argtypes = [c_uint64, c_uint64, c_int, c_double,
+                                  c_double, c_int]
+lib.tableMove.argtypes = [c_uint64, c_uint64, c_int]
 
-state_8 = c_int * 8
-state_8_8 = state_8 * 8
+# Path of the opening book the engine has mapped
+loaded_book = None
+
+
+def load_book(path):
+    global loaded_book
+    if path == loaded_book:
+        return
+    lib.unloadBook()
+    loaded_book = None
+    if path is not None and os.path.exists(path) and \
+            not lib.loadBook(path.encode()):
+        raise Exception("'{}' is not a valid opening book".format(path))
+    loaded_book = path
+
+
+# Path of the pattern tables the engine evaluates with
+loaded_patterns = None
+
+
+def load_patterns(path):
+    global loaded_patterns
+    if path == loaded_patterns:
+        return
+    lib.unloadPatterns()
+    loaded_patterns = None
+    if path is not None and os.path.exists(path) and \
+            not lib.loadPatterns(path.encode()):
+        raise Exception("'{}' is not a valid pattern file".format(path))
+    loaded_patterns = path
+
+
+class SearchStats(Structure):
+    # Mirrors struct SearchStats in cAI.c
+    _fields_ = [("nodes", c_uint64),
+                ("tt_probes", c_uint64),
+                ("tt_hits", c_uint64),
+                ("cutoffs", c_uint64),
+                ("first_move_cutoffs", c_uint64),
+                ("time", c_double),
+                ("source", c_int),
+                ("depth", c_int),
+                ("score", c_double),
+                ("num_ply_times", c_int),
+                ("ply_times", c_double * 64)]
+
+SOURCES = ("search", "book", "endgame")
+# Results of findMoveBitboards other than a move
+SEARCH_FAILED = -1
+NO_MOVE = -2
 
 
 class cAI(Player):
+    # Number of search threads; more than one uses a Lazy SMP search that
+    # shares the engine's transposition table between threads
+    threads = 1
+    # Weights of the six heuristics in the engine's evaluate
+    weights = load_weights(WEIGHTS_PATH)
+    # Positions with at most this many empty squares are solved exactly. The
+    # solver has no transposition table, and at 16 empties it already runs
+    # out of its half of a 3 second move on some positions; 14 solve in
+    # hundredths of a second. The Python AI is far slower and uses 12.
+    endgame_empties = 14
+    # Opening book to play from, if the file exists
+    book_path = BOOK_PATH
+    # Pattern tables to evaluate with instead of the heuristics, if the file
+    # exists
+    pattern_path = PATTERN_PATH
+    # Deepest iteration of the search, or None to search until time runs out
+    max_depth = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Position searched during the opponent's last turn, as masks
+        self.pondered = None
+
+    def setup(self, board):
+        load_book(self.book_path)
+        load_patterns(self.pattern_path)
+        lib.setWeights((c_double * len(FEATURES))(*self.weights))
+        lib.setEndgameEmpties(self.endgame_empties)
+        lib.setMaxDepth(self.max_depth or 0)
+        # A BitBoard already holds the masks the engine searches on
+        if isinstance(board, BitBoard):
+            return board.black, board.white
+        return board.masks(State.black)
 
     def move(self, board):
-        c_board = state_8_8(*[state_8(*row) for row in board])
-        max_time = c_double(self.max_time - 1)
+        black, white = self.setup(board)
+        ponder_hit = self.pondered == (black, white)
+        self.pondered = None
+
+        clock = TimeManager(self.max_time, 64 - (black | white).bit_count())
+        move_i = lib.findMoveBitboards(black, white, self.color,
+                                       clock.hard - clock.start,
+                                       clock.soft - clock.start, self.threads)
+        if move_i == SEARCH_FAILED:
+            raise Exception("The C engine could not allocate memory for its "
+                            "search")
 
-        move_i = lib.findMove(c_board, self.color, max_time)
+        stats = SearchStats()
+        lib.getLastStats(byref(stats))
+        self.stats = {"source": SOURCES[stats.source],
+                      "nodes": stats.nodes,
+                      "nps": stats.nodes / stats.time if stats.time else 0.0,
+                      "depth": stats.depth,
+                      "score": None if math.isnan(stats.score) else
+                      stats.score,
+                      "time": stats.time,
+                      "ply_times": stats.ply_times[:stats.num_ply_times],
+                      "tt_probes": stats.tt_probes,
+                      "tt_hits": stats.tt_hits,
+                      "tt_hit_rate": stats.tt_hits / stats.tt_probes
+                      if stats.tt_probes else 0.0,
+                      "cutoffs": stats.cutoffs,
+                      "first_move_cutoffs": stats.first_move_cutoffs,
+                      "ponder_hit": ponder_hit}
+        if move_i == NO_MOVE:
+            return None
         return (move_i & 63, (move_i & (63 << 6)) >> 6)
+
+    def ponder(self, board, stop):
+        """Searches the position after the opponent's expected reply, taken
+        from the engine's transposition table, on a background thread until
+        stop() is true, so that the next move finds it in the table."""
+        if 64 - board.total_count() <= self.endgame_empties + 1:
+            return
+
+        black, white = self.setup(board)
+        opponent = State.opponent(self.color)
+        replies = board.legal_moves(opponent)
+        if replies:
+            square = lib.tableMove(black, white, opponent)
+            reply = (square >> 3, square & 7)
+            if square < 0 or reply not in replies:
+                return
+            board.make_move(reply[0], reply[1], opponent)
+            black, white = board.masks(State.black)
+        if not board.legal_moves(self.color):
+            return
+
+        lib.setVerbose(0)
+        lib.requestStop(0)
+        search = threading.Thread(target=lib.findMoveBitboards,
+                                  args=(black, white, self.color, 1e9, 1e9,
+                                        self.threads))
+        search.start()
+        self.pondered = (black, white)
+        while search.is_alive() and not stop():
+            search.join(0.01)
+        lib.requestStop(1)
+        search.join()
+        lib.requestStop(0)
+        lib.setVerbose(1)
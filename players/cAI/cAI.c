@@ -4,11 +4,23 @@
 #include <time.h>
 #include <unistd.h>
 #include <stdbool.h>
+#include <stdint.h>
 #include <math.h>
 #include <stdlib.h>
+#include <pthread.h>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 
 typedef int Board[8][8];
+typedef uint64_t Bitboard;
+
+// Square (row, col) is bit row * 8 + col
+#define FULL  0xFFFFFFFFFFFFFFFFULL
+#define NOT_A 0xFEFEFEFEFEFEFEFEULL  // every column except column 0
+#define NOT_H 0x7F7F7F7F7F7F7F7FULL  // every column except column 7
+#define CORNERS 0x8100000000000081ULL
 
 static double INF = 99999999999999;
 static bool ANSI_COLORS = false;
@@ -26,10 +38,12 @@ typedef enum {
 } State;
 
 
+// Most pattern instances a pattern file may have
+#define MAX_INSTANCES 64
+
 struct GameState {
-    Board board;
-    struct GameState *children[64];
-    int numChildren;
+    Bitboard black;
+    Bitboard white;
     int depth;
     State player;
     Coord move;
@@ -37,19 +51,93 @@ struct GameState {
     int numWhite;
     int numBlack;
     int numEmpty;
+    uint16_t patterns[MAX_INSTANCES];  // index of each pattern instance
 };
 typedef struct GameState GameState;
 
-Coord DIRECTIONS[8] = {
-    {-1,  0}, // N
-    {-1,  1}, // NE
-    { 0,  1}, // E
-    { 1,  1}, // SE
-    { 1,  0}, // S
-    { 1, -1}, // SW
-    { 0, -1}, // W
-    {-1, -1}  // NW
-};
+#define MAX_DEPTH 64
+
+// Everything one search needs, allocated once per findMove call. stack[d] is
+// the node being searched at depth d, so children are written into the
+// following slot instead of being allocated.
+typedef struct Search {
+    double startTime;
+    double maxTime;   // searches still running after this are aborted
+    double softTime;  // no iteration is started after this
+    const int *stop;  // set by the main thread to end a parallel search
+    int plies;
+    int peakDepth;
+    uint64_t nodes;
+    uint64_t ttProbes;
+    uint64_t ttHits;
+    uint64_t cutoffs;
+    uint64_t firstMoveCutoffs;
+    GameState stack[MAX_DEPTH + 1];
+    int numRootMoves;
+    Coord rootMoves[64];
+    double rootScores[64];
+} Search;
+
+// Shared transposition table. Entries are written without locks: check is
+// the position key xor'ed with both data words, so an entry torn by two
+// threads writing at once simply fails to match on the next probe.
+typedef struct TTEntry {
+    uint64_t check;
+    uint64_t score;  // bits of a double
+    uint64_t info;   // depth | bound << 8 | (move + 1) << 10 | generation << 17
+} TTEntry;
+
+enum { TT_EXACT = 0, TT_LOWER = 1, TT_UPPER = 2 };
+
+// Statistics about the last findMove call, read from Python through
+// getLastStats. Counters are summed over all search threads.
+enum { SOURCE_SEARCH = 0, SOURCE_BOOK = 1, SOURCE_ENDGAME = 2 };
+
+typedef struct SearchStats {
+    uint64_t nodes;
+    uint64_t ttProbes;
+    uint64_t ttHits;
+    uint64_t cutoffs;
+    uint64_t firstMoveCutoffs;
+    double time;
+    int source;
+    int depth;
+    double score;  // of the chosen move, from the heuristic search only
+    int numPlyTimes;
+    double plyTimes[MAX_DEPTH];  // seconds per ply of the main thread
+} SearchStats;
+
+static SearchStats lastStats;
+
+void getLastStats(SearchStats *stats) {
+    *stats = lastStats;
+}
+
+#define TT_BITS 20
+static TTEntry *TABLE = NULL;
+static uint64_t generation = 0;
+
+// Left shifts move towards higher rows/columns, right shifts towards lower
+// ones. The masks drop the bits that wrap around to the other side of the
+// board.
+static const int SHIFTS[4] = {1, 7, 8, 9};
+static const Bitboard LEFT_MASKS[4] = {NOT_A, NOT_H, FULL, NOT_A};
+static const Bitboard RIGHT_MASKS[4] = {NOT_H, NOT_A, FULL, NOT_H};
+
+static const int DISK_SQUARES[64] = {20, -3, 11,  8,  8, 11, -3, 20,
+                                     -3, -7, -4,  1,  1, -4, -7, -3,
+                                     11, -4,  2,  2,  2,  2, -4, 11,
+                                      8,  1,  2, -3, -3,  2,  1,  8,
+                                      8,  1,  2, -3, -3,  2,  1,  8,
+                                     11, -4,  2,  2,  2,  2, -4, 11,
+                                     -3, -7, -4,  1,  1, -4, -7, -3,
+                                     20, -3, 11,  8,  8, 11, -3, 20};
+
+// Each corner followed by the three squares next to it
+static const int CORNER_ADJ[4][4] = {{0, 1, 9, 8},
+                                     {7, 6, 14, 15},
+                                     {56, 48, 49, 57},
+                                     {63, 62, 54, 55}};
 
 int coordToInt(Coord c) {
     return c.r + (c.c << 6);
@@ -68,58 +156,46 @@ double getWallTime(){
     return (double)time.tv_sec + (double)time.tv_usec * 0.000001;
 }
 
-void copyBoard(Board dest, Board src) {
+void boardToBitboards(Board board, Bitboard *black, Bitboard *white) {
+    *black = 0;
+    *white = 0;
     for (int i = 0; i < 8; ++i) {
         for (int j = 0; j < 8; ++j) {
-            dest[i][j] = src[i][j];
+            if (board[i][j] == BLACK)
+                *black |= 1ULL << (i * 8 + j);
+            else if (board[i][j] == WHITE)
+                *white |= 1ULL << (i * 8 + j);
         }
     }
 }
 
-void printBoard(Board board) {
-    for (int i = 0; i < 8; ++i) {
-        for (int j = 0; j < 8; ++j) {
-            if (board[i][j] == BLACK) {
-                if (ANSI_COLORS)
-                    printf("\033[30m\033[42m * \033[00m");
-                else
-                    printf(" B ");
-            } else if (board[i][j] == WHITE) {
-                if (ANSI_COLORS)
-                    printf("\033[37m\033[42m * \033[00m");
-                else
-                    printf(" W ");
-            } else {
-                if (ANSI_COLORS)
-                    printf("\033[42m . \033[00m");
-                else
-                    printf(" . ");
-            }
+void printBoard(Bitboard black, Bitboard white) {
+    for (int i = 0; i < 64; ++i) {
+        if (black & (1ULL << i)) {
+            if (ANSI_COLORS)
+                printf("\033[30m\033[42m * \033[00m");
+            else
+                printf(" B ");
+        } else if (white & (1ULL << i)) {
+            if (ANSI_COLORS)
+                printf("\033[37m\033[42m * \033[00m");
+            else
+                printf(" W ");
+        } else {
+            if (ANSI_COLORS)
+                printf("\033[42m . \033[00m");
+            else
+                printf(" . ");
         }
-        printf("\n");
+        if ((i & 7) == 7)
+            printf("\n");
     }
 }
 
 void updateStateCounts(GameState *state) {
-    state->numBlack = 0;
-    state->numWhite = 0;
-    state->numEmpty = 0;
-
-    for (int i = 0; i < 8; ++i) {
-        for (int j = 0; j < 8; ++j) {
-            switch (state->board[i][j]) {
-                case BLACK:
-                    state->numBlack++;
-                    break;
-                case WHITE:
-                    state->numWhite++;
-                    break;
-                case EMPTY:
-                    state->numEmpty++;
-                    break;
-            }
-        }
-    }
+    state->numBlack = __builtin_popcountll(state->black);
+    state->numWhite = __builtin_popcountll(state->white);
+    state->numEmpty = 64 - state->numBlack - state->numWhite;
 }
 
 State getOpponent(State s) {
@@ -128,95 +204,306 @@ State getOpponent(State s) {
     return BLACK;
 }
 
-bool moveWouldCapture(Board board, int row, int col, State player) {
-    State opponent = getOpponent(player);
+// Kogge-Stone occluded fills: gen spreads through the squares in pro, one
+// direction at a time, in log2(7) steps.
+static inline Bitboard fillLeft(Bitboard gen, Bitboard pro, int s,
+                                Bitboard mask) {
+    pro &= mask;
+    gen |= pro & (gen << s);
+    pro &= pro << s;
+    gen |= pro & (gen << (2 * s));
+    pro &= pro << (2 * s);
+    gen |= pro & (gen << (4 * s));
+    return gen;
+}
 
-    for (int i = 0; i < 8; ++i) {
-        int drow = DIRECTIONS[i].r;
-        int dcol = DIRECTIONS[i].c;
-
-        int rowp = row + drow;
-        int colp = col + dcol;
-
-        if (!(0 <= rowp && rowp <= 7 &&
-              0 <= colp && colp <= 7 &&
-              board[rowp][colp] == opponent))
-            continue;
-
-        while (0 <= rowp && rowp <= 7 &&
-               0 <= colp && colp <= 7 &&
-               board[rowp][colp] == opponent) {
-            rowp += drow;
-            colp += dcol;
-        }
+static inline Bitboard fillRight(Bitboard gen, Bitboard pro, int s,
+                                 Bitboard mask) {
+    pro &= mask;
+    gen |= pro & (gen >> s);
+    pro &= pro >> s;
+    gen |= pro & (gen >> (2 * s));
+    pro &= pro >> (2 * s);
+    gen |= pro & (gen >> (4 * s));
+    return gen;
+}
 
-        if (0 <= rowp && rowp <= 7 &&
-            0 <= colp && colp <= 7 &&
-            board[rowp][colp] == player)
-            return true;
+Bitboard legalMask(Bitboard own, Bitboard opp) {
+    Bitboard empty = ~(own | opp);
+    Bitboard moves = 0;
+    for (int i = 0; i < 4; ++i) {
+        int s = SHIFTS[i];
+        Bitboard left = fillLeft(own, opp, s, LEFT_MASKS[i]) & opp;
+        Bitboard right = fillRight(own, opp, s, RIGHT_MASKS[i]) & opp;
+        moves |= (left << s) & LEFT_MASKS[i];
+        moves |= (right >> s) & RIGHT_MASKS[i];
     }
+    return moves & empty;
+}
 
-    return false;
+Bitboard flipMask(Bitboard own, Bitboard opp, Bitboard move) {
+    Bitboard flips = 0;
+    for (int i = 0; i < 4; ++i) {
+        int s = SHIFTS[i];
+        Bitboard left = fillLeft(move, opp, s, LEFT_MASKS[i]);
+        if ((left << s) & LEFT_MASKS[i] & own)
+            flips |= left & opp;
+        Bitboard right = fillRight(move, opp, s, RIGHT_MASKS[i]);
+        if ((right >> s) & RIGHT_MASKS[i] & own)
+            flips |= right & opp;
+    }
+    return flips;
 }
 
-void legalMoves(Board board, State player, Coord moves[64], int *numMoves) {
+void legalMoves(GameState *state, State player, Coord moves[64],
+                int *numMoves) {
+    Bitboard mask = player == BLACK ?
+        legalMask(state->black, state->white) :
+        legalMask(state->white, state->black);
+
     *numMoves = 0;
-    for (int row = 0; row < 8; ++row) {
-        for (int col = 0; col < 8; ++col) {
-            if (board[row][col] == EMPTY) {
-                if (moveWouldCapture(board, row, col, player)) {
-                    moves[(*numMoves)++] = (Coord){row, col};
-                }
-            }
-        }
+    while (mask) {
+        int sq = __builtin_ctzll(mask);
+        moves[(*numMoves)++] = (Coord){sq >> 3, sq & 7};
+        mask &= mask - 1;
     }
+}
 
+// Returns the flipped disks
+Bitboard makeMove(GameState *state, Coord pos, State player) {
+    Bitboard move = 1ULL << (pos.r * 8 + pos.c);
+    Bitboard flips;
+    if (player == BLACK) {
+        flips = flipMask(state->black, state->white, move);
+        state->black |= move | flips;
+        state->white ^= flips;
+    } else {
+        flips = flipMask(state->white, state->black, move);
+        state->white |= move | flips;
+        state->black ^= flips;
+    }
+    return flips;
 }
 
-void makeMove(Board board, Coord pos, State player) {
-    int row = pos.r;
-    int col = pos.c;
+static inline uint64_t mix64(uint64_t x) {
+    x ^= x >> 33;
+    x *= 0xFF51AFD7ED558CCDULL;
+    x ^= x >> 33;
+    x *= 0xC4CEB9FE1A85EC53ULL;
+    x ^= x >> 33;
+    return x;
+}
 
-    board[row][col] = player;
+uint64_t hashPosition(Bitboard black, Bitboard white, State player) {
+    uint64_t key = mix64(black ^ mix64(white + 0x9E3779B97F4A7C15ULL));
+    return player == WHITE ? ~key : key;
+}
 
-    State opponent = getOpponent(player);
-    for (int i = 0; i < 8; ++i) {
-        int drow = DIRECTIONS[i].r;
-        int dcol = DIRECTIONS[i].c;
-        int rowp = row + drow;
-        int colp = col + dcol;
-
-        if (!(0 <= rowp && rowp <= 7 &&
-              0 <= colp && colp <= 7 &&
-              board[rowp][colp] == opponent))
-            continue;
-
-        while (0 <= rowp && rowp <= 7 &&
-               0 <= colp && colp <= 7 &&
-               board[rowp][colp] == opponent) {
-            rowp += drow;
-            colp += dcol;
-        }
+bool probeTT(uint64_t key, double *score, int *depth, int *bound, int *move) {
+    TTEntry *e = &TABLE[key & ((1ULL << TT_BITS) - 1)];
+    uint64_t scoreBits = __atomic_load_n(&e->score, __ATOMIC_RELAXED);
+    uint64_t info = __atomic_load_n(&e->info, __ATOMIC_RELAXED);
+    uint64_t check = __atomic_load_n(&e->check, __ATOMIC_RELAXED);
+    if ((check ^ scoreBits ^ info) != key)
+        return false;
 
-        if (0 <= rowp && rowp <= 7 &&
-            0 <= colp && colp <= 7 &&
-            board[rowp][colp] == player) {
-            rowp -= drow;
-            colp -= dcol;
+    memcpy(score, &scoreBits, sizeof(double));
+    *depth = info & 255;
+    *bound = (info >> 8) & 3;
+    *move = (int)((info >> 10) & 127) - 1;
+    return true;
+}
+
+void storeTT(uint64_t key, double score, int depth, int bound, int move) {
+    TTEntry *e = &TABLE[key & ((1ULL << TT_BITS) - 1)];
+    uint64_t oldInfo = __atomic_load_n(&e->info, __ATOMIC_RELAXED);
+    // Keep deeper entries from this search, replace anything older
+    if ((oldInfo >> 17) == generation && (int)(oldInfo & 255) > depth)
+        return;
+
+    uint64_t scoreBits;
+    memcpy(&scoreBits, &score, sizeof(double));
+    uint64_t info = (uint64_t)depth | ((uint64_t)bound << 8) |
+                    ((uint64_t)(move + 1) << 10) | (generation << 17);
+    __atomic_store_n(&e->check, key ^ scoreBits ^ info, __ATOMIC_RELAXED);
+    __atomic_store_n(&e->score, scoreBits, __ATOMIC_RELAXED);
+    __atomic_store_n(&e->info, info, __ATOMIC_RELAXED);
+}
 
-            while (!(rowp == row && colp == col)) {
-                board[rowp][colp] = player;
+// Number of (disk, empty neighbour) pairs for the disks in own
+int frontier(Bitboard own, Bitboard empty) {
+    int total = 0;
+    for (int i = 0; i < 4; ++i) {
+        int s = SHIFTS[i];
+        total += __builtin_popcountll(own & ((empty >> s) & RIGHT_MASKS[i]));
+        total += __builtin_popcountll(own & ((empty << s) & LEFT_MASKS[i]));
+    }
+    return total;
+}
 
-                rowp -= drow;
-                colp -= dcol;
+// Pattern tables written by patterns.py. When they are loaded evaluate
+// looks the position up in them instead of computing the heuristics, and
+// the search keeps the index of every instance in GameState.patterns up to
+// date from the flips of each move.
+#define MAX_PATTERN_SIZE 10          // so that indices fit in 16 bits
+#define MAX_SQUARE_INSTANCES 16
+
+static int patternPhases = 0;        // 0 when no tables are loaded
+static int numInstances = 0;
+static double patternScale = 1.0;
+static int16_t *patternTables = NULL;
+static size_t phaseEntries = 0;
+static int instanceSize[MAX_INSTANCES];
+static uint8_t instanceSquares[MAX_INSTANCES][MAX_PATTERN_SIZE];
+static size_t instanceTable[MAX_INSTANCES];  // offset of its pattern's table
+static int numSquareInstances[64];
+static int squareInstance[64][MAX_SQUARE_INSTANCES];
+static int squarePower[64][MAX_SQUARE_INSTANCES];
+
+void unloadPatterns(void) {
+    free(patternTables);
+    patternTables = NULL;
+    patternPhases = 0;
+}
+
+int loadPatterns(const char *path) {
+    unloadPatterns();
+    FILE *f = fopen(path, "rb");
+    if (f == NULL)
+        return 0;
+    fseek(f, 0, SEEK_END);
+    long size = ftell(f);
+    fseek(f, 0, SEEK_SET);
+    unsigned char *data = malloc(size > 0 ? size : 1);
+    if (data == NULL || fread(data, 1, size, f) != (size_t)size) {
+        free(data);
+        fclose(f);
+        return 0;
+    }
+    fclose(f);
+
+    // Header: magic, phases and number of patterns (uint16), scale (float)
+    uint16_t phases, patterns;
+    float scale;
+    long offset = 16;
+    if (size < offset || memcmp(data, "OTHPATT1", 8) != 0)
+        goto invalid;
+    memcpy(&phases, data + 8, 2);
+    memcpy(&patterns, data + 10, 2);
+    memcpy(&scale, data + 12, 4);
+
+    // Squares of every instance
+    size_t entries = 0;
+    numInstances = 0;
+    memset(numSquareInstances, 0, sizeof(numSquareInstances));
+    for (int p = 0; p < patterns; ++p) {
+        if (offset + 2 > size)
+            goto invalid;
+        int squares = data[offset];
+        int instances = data[offset + 1];
+        offset += 2;
+        if (squares > MAX_PATTERN_SIZE ||
+            numInstances + instances > MAX_INSTANCES ||
+            offset + squares * instances > size)
+            goto invalid;
+        for (int i = 0; i < instances; ++i) {
+            int instance = numInstances++;
+            instanceSize[instance] = squares;
+            instanceTable[instance] = entries;
+            int power = 1;
+            for (int k = 0; k < squares; ++k) {
+                int square = data[offset++];
+                if (square >= 64 ||
+                    numSquareInstances[square] == MAX_SQUARE_INSTANCES)
+                    goto invalid;
+                instanceSquares[instance][k] = square;
+                int n = numSquareInstances[square]++;
+                squareInstance[square][n] = instance;
+                squarePower[square][n] = power;
+                power *= 3;
             }
         }
+        int tableSize = 1;
+        for (int k = 0; k < squares; ++k)
+            tableSize *= 3;
+        entries += tableSize;
     }
+
+    // One int16 table per pattern and phase
+    if (phases == 0 || offset + (long)(phases * entries * 2) != size)
+        goto invalid;
+    patternTables = malloc(phases * entries * sizeof(int16_t));
+    if (patternTables == NULL)
+        goto invalid;
+    memcpy(patternTables, data + offset, phases * entries * sizeof(int16_t));
+    free(data);
+    phaseEntries = entries;
+    patternScale = scale;
+    patternPhases = phases;
+    return 1;
+
+invalid:
+    free(data);
+    return 0;
+}
+
+void initPatterns(GameState *state) {
+    for (int i = 0; i < numInstances; ++i) {
+        int index = 0;
+        for (int k = instanceSize[i] - 1; k >= 0; --k) {
+            Bitboard sq = 1ULL << instanceSquares[i][k];
+            index = index * 3 + ((state->black & sq) ? 1 :
+                                 (state->white & sq) ? 2 : 0);
+        }
+        state->patterns[i] = index;
+    }
+}
+
+// A disk placed adds its colour's digit (1 for black, 2 for white) and a
+// flip changes the digit by one
+static inline void updatePatterns(GameState *state, int square,
+                                  Bitboard flips, State player) {
+    int flip = player == BLACK ? -1 : 1;
+    for (int n = 0; n < numSquareInstances[square]; ++n)
+        state->patterns[squareInstance[square][n]] +=
+            player * squarePower[square][n];
+    for (; flips; flips &= flips - 1) {
+        int sq = __builtin_ctzll(flips);
+        for (int n = 0; n < numSquareInstances[sq]; ++n)
+            state->patterns[squareInstance[sq][n]] +=
+                flip * squarePower[sq][n];
+    }
+}
+
+// Predicted final disk difference, black minus white
+double patternScore(const GameState *state) {
+    int disks = __builtin_popcountll(state->black | state->white);
+    const int16_t *tables = patternTables +
+        (size_t)((disks - 4) * patternPhases / 61) * phaseEntries;
+    int total = 0;
+    for (int i = 0; i < numInstances; ++i)
+        total += tables[instanceTable[i] + state->patterns[i]];
+    return total / patternScale;
+}
+
+// Weights of the heuristics in evaluate, in the order of tune.FEATURES
+static double weights[6] = {10.0, 801.724, 382.026, 78.922, 74.396, 10.0};
+
+void setWeights(const double *w) {
+    for (int i = 0; i < 6; ++i)
+        weights[i] = w[i];
 }
 
 void evaluate(GameState *state) {
+    if (patternPhases) {
+        state->score = patternScore(state);
+        return;
+    }
     updateStateCounts(state);
 
+    Bitboard black = state->black;
+    Bitboard white = state->white;
+    Bitboard empty = ~(black | white);
     int B;
     int W;
 
@@ -227,22 +514,15 @@ void evaluate(GameState *state) {
     if (B > W) {
         P = 100.0 * B / (B + W);
     } else if (B < W) {
-        P = 100.0 * W / (B + W);
+        P = -100.0 * W / (B + W);
     } else {
         P = 0.0;
     }
 
     // Corner occupancy
     double C;
-    B = 0;
-    W = 0;
-    int corners[4][2] = {{0, 0}, {0, 7}, {7, 0}, {7, 7}};
-    for (int i = 0; i < 4; ++i) {
-        if (state->board[corners[i][0]][corners[i][1]] == BLACK)
-            B++;
-        else if (state->board[corners[i][0]][corners[i][1]] == WHITE)
-            W++;
-    }
+    B = __builtin_popcountll(black & CORNERS);
+    W = __builtin_popcountll(white & CORNERS);
     C = 25.0 * B - 25.0 * W;
 
 
@@ -250,20 +530,14 @@ void evaluate(GameState *state) {
     double L;
     B = 0;
     W = 0;
-    int cornerAdj[4][3][2] = {{{0, 1}, {1, 1}, {1, 0}},
-                              {{0, 6}, {1, 6}, {1, 7}},
-                              {{6, 0}, {6, 1}, {7, 1}},
-                              {{7, 6}, {6, 6}, {6, 7}}};
     for (int i = 0; i < 4; ++i) {
-        if (state->board[corners[i][0]][corners[i][1]] == EMPTY) {
-            for (int j = 0; j < 3; ++j) {
-                int row = cornerAdj[i][j][0];
-                int col = cornerAdj[i][j][1];
-                if (state->board[row][col] == BLACK) {
+        if (empty & (1ULL << CORNER_ADJ[i][0])) {
+            for (int j = 1; j < 4; ++j) {
+                Bitboard sq = 1ULL << CORNER_ADJ[i][j];
+                if (black & sq)
                     B++;
-                } else if (state->board[row][col] == WHITE) {
+                else if (white & sq)
                     W++;
-                }
             }
         }
     }
@@ -272,20 +546,8 @@ void evaluate(GameState *state) {
 
     // Mobility
     double M;
-    B = 0;
-    W = 0;
-    for (int i = 0; i < 8; ++i) {
-        for (int j = 0; j < 8; ++j) {
-            if (state->board[i][j] == EMPTY) {
-                if (moveWouldCapture(state->board, i, j, BLACK)) {
-                    B++;
-                }
-                if (moveWouldCapture(state->board, i, j, WHITE)) {
-                    W++;
-                }
-            }
-        }
-    }
+    B = __builtin_popcountll(legalMask(black, white));
+    W = __builtin_popcountll(legalMask(white, black));
     if (B > W)
         M = 100.0 * B / (B + W);
     else if (B < W)
@@ -296,28 +558,8 @@ void evaluate(GameState *state) {
 
     // Frontier disks
     double F;
-    B = 0;
-    W = 0;
-    for (int row = 0; row < 8; ++row) {
-        for (int col = 0; col < 8; ++col) {
-            if (state->board[row][col] == EMPTY)
-                continue;
-
-            for (int di = 0; di < 8; ++di) {
-                int rowp = row + DIRECTIONS[di].r;
-                int colp = col + DIRECTIONS[di].c;
-
-                if ((0 <= rowp <= 7) && (0 <= colp <= 7)) {
-                    if (state->board[rowp][colp] == EMPTY) {
-                        if (state->board[row][col] == BLACK)
-                            B++;
-                        else if (state->board[row][col] == WHITE)
-                            W++;
-                    }
-                }
-            }
-        }
-    }
+    B = frontier(black, empty);
+    W = frontier(white, empty);
     if (B > W)
         F = -100.0 * B / (B + W);
     else if (B < W)
@@ -327,24 +569,11 @@ void evaluate(GameState *state) {
 
     // Disk squares
     double D = 0.0;
-    int V[8][8] = {{20, -3, 11,  8,  8, 11, -3, 20},
-                   {-3, -7, -4,  1,  1, -4, -7, -3},
-                   {11, -4,  2,  2,  2,  2, -4, 11},
-                   { 8,  1,  2, -3, -3,  2,  1,  8},
-                   { 8,  1,  2, -3, -3,  2,  1,  8},
-                   {11, -4,  2,  2,  2,  2, -4, 11},
-                   {-3, -7, -4,  1,  1, -4, -7, -3},
-                   {20, -3, 11,  8,  8, 11, -3, 20}};
-    for (int row = 0; row < 8; ++row) {
-        for (int col = 0; col < 8; ++col) {
-            if (state->board[row][col] == BLACK)
-                D += V[row][col] * 1.0;
-            else if (state->board[row][col] == WHITE)
-                D += V[row][col] * -1.0;
-        }
-    }
+    for (Bitboard b = black; b; b &= b - 1)
+        D += DISK_SQUARES[__builtin_ctzll(b)];
+    for (Bitboard w = white; w; w &= w - 1)
+        D -= DISK_SQUARES[__builtin_ctzll(w)];
 
-    double weights[6] = {10.0, 801.724, 382.026, 78.922, 74.396, 10.0};
     double heuristics[6] = {P, C, L, M, F, D};
     double score = 0.0;
     for (int i = 0; i < 6; ++i)
@@ -353,118 +582,693 @@ void evaluate(GameState *state) {
 }
 
 
-bool search(GameState *state,
-            double alpha,
-            double beta,
-            double startTime,
-            double maxTime,
-            int plies) {
-    if ((getWallTime() - startTime) >= maxTime)
+// Nodes between clock checks; must be a power of two
+#define CHECK_INTERVAL 1024
+
+// Set from another thread to end the current search, which is how Python
+// ends a search on the opponent's time
+static int stopRequested = 0;
+
+void requestStop(int value) {
+    __atomic_store_n(&stopRequested, value, __ATOMIC_RELAXED);
+}
+
+// Whether findMove prints its progress
+static int verbose = 1;
+
+void setVerbose(int value) {
+    verbose = value;
+}
+
+bool search(Search *s, int depth, double alpha, double beta) {
+    s->nodes++;
+    if ((!(s->nodes & (CHECK_INTERVAL - 1)) &&
+         (getWallTime() - s->startTime) >= s->maxTime) ||
+        __atomic_load_n(s->stop, __ATOMIC_RELAXED) ||
+        __atomic_load_n(&stopRequested, __ATOMIC_RELAXED))
         return false;
 
+    GameState *state = &s->stack[depth];
+    if (depth > s->peakDepth)
+        s->peakDepth = depth;
+
     State player = getOpponent(state->player);
+    int remaining = s->plies - depth;
+    uint64_t key = hashPosition(state->black, state->white, player);
+    int ttMove = -1;
+    double ttScore;
+    int ttDepth, ttBound;
+    s->ttProbes++;
+    bool hit = probeTT(key, &ttScore, &ttDepth, &ttBound, &ttMove);
+    if (hit)
+        s->ttHits++;
+    if (hit && depth > 0 && ttDepth >= remaining) {
+        if (ttBound == TT_EXACT) {
+            state->score = ttScore;
+            return true;
+        } else if (ttBound == TT_LOWER) {
+            alpha = (alpha > ttScore ? alpha : ttScore);
+        } else {
+            beta = (beta < ttScore ? beta : ttScore);
+        }
+        if (alpha >= beta) {
+            state->score = ttScore;
+            return true;
+        }
+    }
+
     Coord moves[64];
     int numMoves;
-    legalMoves(state->board, player, moves, &numMoves);
+    legalMoves(state, player, moves, &numMoves);
 
-    if ((state->depth == plies) || (numMoves == 0)) {
+    if ((depth == s->plies) || (numMoves == 0)) {
         evaluate(state);
-    } else {
-        for (int i = 0; i < numMoves; ++i) {
-            Coord move = moves[i];
-            GameState *nextState = malloc(sizeof(GameState));
-            copyBoard(nextState->board, state->board);
-            makeMove(nextState->board, move, player);
-            nextState->player = player;
-            nextState->depth = state->depth + 1;
-            nextState->numChildren = 0;
-            nextState->move = move;
-
+        return true;
+    }
 
-            bool success = search(nextState, alpha, beta, startTime, maxTime, plies);
+    // Try the move stored in the transposition table first
+    for (int i = 1; i < numMoves; ++i) {
+        if (moves[i].r * 8 + moves[i].c == ttMove) {
+            Coord move = moves[i];
+            moves[i] = moves[0];
+            moves[0] = move;
+            break;
+        }
+    }
 
-            if (!success) {
-                free(nextState);
-                return false;
+    GameState *nextState = &s->stack[depth + 1];
+    double originalAlpha = alpha;
+    double originalBeta = beta;
+    int bestMove = -1;
+    state->score = (player == BLACK ? -INF : INF);
+    if (depth == 0)
+        s->numRootMoves = 0;
+
+    for (int i = 0; i < numMoves; ++i) {
+        Coord move = moves[i];
+        nextState->black = state->black;
+        nextState->white = state->white;
+        Bitboard flips = makeMove(nextState, move, player);
+        if (patternPhases) {
+            memcpy(nextState->patterns, state->patterns,
+                   numInstances * sizeof(uint16_t));
+            updatePatterns(nextState, move.r * 8 + move.c, flips, player);
+        }
+        nextState->player = player;
+        nextState->depth = depth + 1;
+        nextState->move = move;
+
+        if (!search(s, depth + 1, alpha, beta))
+            return false;
+
+        // Black maximises and white minimises on their own turns
+        if (player == BLACK) {
+            if (nextState->score > state->score) {
+                state->score = nextState->score;
+                bestMove = move.r * 8 + move.c;
             }
-
-            if (state->player == BLACK) {
-                alpha = (alpha > nextState->score ? alpha : nextState->score); // max
-                state->score = alpha;
-            } else {
-                beta = (beta < nextState->score ? beta : nextState->score); // min
-                state->score = beta;
+            alpha = (alpha > state->score ? alpha : state->score);
+        } else {
+            if (nextState->score < state->score) {
+                state->score = nextState->score;
+                bestMove = move.r * 8 + move.c;
             }
+            beta = (beta < state->score ? beta : state->score);
+        }
 
-            if (alpha >= beta) {
-                free(nextState);
-                break;
-            }
+        if (depth == 0) {
+            s->rootMoves[s->numRootMoves] = move;
+            s->rootScores[s->numRootMoves++] = nextState->score;
+        }
 
-            if (state->depth == 0) {
-                state->children[(state->numChildren)++] = nextState;
-            } else {
-                free(nextState);
-            }
+        if (alpha >= beta) {
+            s->cutoffs++;
+            if (i == 0)
+                s->firstMoveCutoffs++;
+            break;
         }
     }
 
+    int bound = TT_EXACT;
+    if (state->score <= originalAlpha)
+        bound = TT_UPPER;
+    else if (state->score >= originalBeta)
+        bound = TT_LOWER;
+    storeTT(key, state->score, remaining, bound, bestMove);
+
     return true;
 }
 
 
-int findMove(Board board, State color, double maxTime) {
-    double startTime = getWallTime();
-    Coord bestMove;
-    int plies = 0;
+// Symmetries of the board. Symmetry t is applied as: transpose if t & 4,
+// then flip the rows if t & 2, then flip the columns if t & 1. book.py uses
+// the same numbering.
+Bitboard flipRows(Bitboard x) {
+    return __builtin_bswap64(x);
+}
 
-    GameState state;
-    copyBoard(state.board, board);
-    state.depth = 0;
-    state.player = getOpponent(color);
+Bitboard flipColumns(Bitboard x) {
+    x = ((x >> 1) & 0x5555555555555555ULL) | ((x & 0x5555555555555555ULL) << 1);
+    x = ((x >> 2) & 0x3333333333333333ULL) | ((x & 0x3333333333333333ULL) << 2);
+    x = ((x >> 4) & 0x0F0F0F0F0F0F0F0FULL) | ((x & 0x0F0F0F0F0F0F0F0FULL) << 4);
+    return x;
+}
+
+Bitboard transpose(Bitboard x) {
+    Bitboard t;
+    t = 0x0F0F0F0F00000000ULL & (x ^ (x << 28));
+    x ^= t ^ (t >> 28);
+    t = 0x3333000033330000ULL & (x ^ (x << 14));
+    x ^= t ^ (t >> 14);
+    t = 0x5500550055005500ULL & (x ^ (x << 7));
+    x ^= t ^ (t >> 7);
+    return x;
+}
+
+Bitboard transform(int t, Bitboard x) {
+    if (t & 4)
+        x = transpose(x);
+    if (t & 2)
+        x = flipRows(x);
+    if (t & 1)
+        x = flipColumns(x);
+    return x;
+}
+
+Bitboard inverseTransform(int t, Bitboard x) {
+    if (t & 1)
+        x = flipColumns(x);
+    if (t & 2)
+        x = flipRows(x);
+    if (t & 4)
+        x = transpose(x);
+    return x;
+}
+
+// Replaces own and opp with the smallest of the eight symmetric forms of
+// the position and returns the symmetry that produces it
+int canonicalPosition(Bitboard *own, Bitboard *opp) {
+    Bitboard bestOwn = *own;
+    Bitboard bestOpp = *opp;
+    int best = 0;
+    for (int t = 1; t < 8; ++t) {
+        Bitboard o = transform(t, *own);
+        Bitboard p = transform(t, *opp);
+        if (o < bestOwn || (o == bestOwn && p < bestOpp)) {
+            bestOwn = o;
+            bestOpp = p;
+            best = t;
+        }
+    }
+    *own = bestOwn;
+    *opp = bestOpp;
+    return best;
+}
 
-    while (true) {
-        plies++;
+// Opening book written by book.py: a 16 byte header (magic, record count)
+// followed by 12 byte records (key, square, score, games) sorted by key
+#define BOOK_HEADER 16
+#define BOOK_RECORD 12
 
-        state.numChildren = 0;
+static const unsigned char *book = NULL;
+static uint64_t bookSize = 0;
+static size_t bookBytes = 0;
 
-        updateStateCounts(&state);
-        int maxPlies = 64 - (state.numBlack + state.numWhite);
+void unloadBook(void) {
+    if (book != NULL)
+        munmap((void *)book, bookBytes);
+    book = NULL;
+    bookSize = 0;
+}
+
+int loadBook(const char *path) {
+    unloadBook();
+    int fd = open(path, O_RDONLY);
+    if (fd < 0)
+        return 0;
+
+    struct stat st;
+    if (fstat(fd, &st) < 0 || st.st_size < BOOK_HEADER) {
+        close(fd);
+        return 0;
+    }
+
+    void *data = mmap(NULL, st.st_size, PROT_READ, MAP_SHARED, fd, 0);
+    close(fd);
+    if (data == MAP_FAILED)
+        return 0;
+    uint64_t records;
+    memcpy(&records, (unsigned char *)data + 8, sizeof(uint64_t));
+    if (memcmp(data, "OTHBOOK1", 8) != 0 ||
+        (uint64_t)st.st_size != BOOK_HEADER + records * BOOK_RECORD) {
+        munmap(data, st.st_size);
+        return 0;
+    }
+
+    book = data;
+    bookBytes = st.st_size;
+    bookSize = records;
+    return 1;
+}
+
+// Returns the book move for the player with disks own, or -1
+int bookMove(Bitboard own, Bitboard opp) {
+    if (book == NULL)
+        return -1;
+
+    Bitboard cOwn = own;
+    Bitboard cOpp = opp;
+    int t = canonicalPosition(&cOwn, &cOpp);
+    uint64_t key = hashPosition(cOwn, cOpp, BLACK);
+
+    uint64_t lo = 0;
+    uint64_t hi = bookSize;
+    while (lo < hi) {
+        uint64_t mid = lo + (hi - lo) / 2;
+        const unsigned char *record = book + BOOK_HEADER + mid * BOOK_RECORD;
+        uint64_t recordKey;
+        memcpy(&recordKey, record, sizeof(uint64_t));
+        if (recordKey < key) {
+            lo = mid + 1;
+        } else if (recordKey > key) {
+            hi = mid;
+        } else {
+            Bitboard move = inverseTransform(t, 1ULL << record[8]);
+            // Guard against hash collisions
+            if (!(move & legalMask(own, opp)))
+                return -1;
+            return __builtin_ctzll(move);
+        }
+    }
+    return -1;
+}
+
+// Positions with at most this many empty squares are solved exactly. Must
+// match cAI.endgame_empties, which Python sets before every search.
+static int endgameEmpties = 14;
+
+void setEndgameEmpties(int empties) {
+    endgameEmpties = empties;
+}
+
+// Deepest iteration of the search, or 0 to search until time runs out
+static int maxDepth = 0;
 
-        if (plies > maxPlies || (getWallTime() - startTime) >= maxTime)
-            return coordToInt(bestMove);
+void setMaxDepth(int depth) {
+    maxDepth = depth;
+}
+
+// Forgets every stored position so that searches can be reproduced
+void clearTable(void) {
+    if (TABLE != NULL)
+        memset(TABLE, 0, (1ULL << TT_BITS) * sizeof(TTEntry));
+}
+
+// Quadrants of the board, used for parity move ordering
+static const Bitboard QUADRANTS[4] = {0x000000000F0F0F0FULL,
+                                      0x00000000F0F0F0F0ULL,
+                                      0x0F0F0F0F00000000ULL,
+                                      0xF0F0F0F000000000ULL};
+
+// Below this many empty squares moves are searched in plain order
+#define MIN_ORDERING_EMPTIES 5
+
+typedef struct Solver {
+    double deadline;
+    uint64_t nodes;
+    bool aborted;
+} Solver;
+
+typedef struct Child {
+    int square;
+    int order;
+    Bitboard own;
+    Bitboard opp;
+} Child;
+
+int orderChildren(Bitboard own, Bitboard opp, Bitboard moves,
+                  Child children[64]) {
+    Bitboard empty = ~(own | opp);
+    bool ordered = __builtin_popcountll(empty) >= MIN_ORDERING_EMPTIES;
+    Bitboard odd = 0;
+    for (int i = 0; i < 4; ++i) {
+        if (__builtin_popcountll(empty & QUADRANTS[i]) & 1)
+            odd |= QUADRANTS[i];
+    }
 
-        bool success = search(&state, -INF, INF, startTime, maxTime, plies);
+    int n = 0;
+    for (; moves; moves &= moves - 1) {
+        int sq = __builtin_ctzll(moves);
+        Bitboard move = 1ULL << sq;
+        Bitboard flips = flipMask(own, opp, move);
+        Child child = {sq, 0, own | move | flips, opp ^ flips};
+
+        // Fastest first: leave the opponent as few replies as possible,
+        // then prefer regions with an odd number of empty squares
+        if (ordered)
+            child.order = 2 * __builtin_popcountll(legalMask(child.opp,
+                                                             child.own)) +
+                          !(odd & move);
+
+        int j = n++;
+        while (j > 0 && children[j - 1].order > child.order) {
+            children[j] = children[j - 1];
+            --j;
+        }
+        children[j] = child;
+    }
+    return n;
+}
 
-        if (!success)
-            return coordToInt(bestMove);
+// Final disk difference from the point of view of the player to move
+int solve(Solver *solver, Bitboard own, Bitboard opp, int alpha, int beta,
+          bool passed) {
+    if ((++solver->nodes & 4095) == 0 && getWallTime() >= solver->deadline)
+        solver->aborted = true;
+    if (solver->aborted)
+        return 0;
 
-        if (state.numChildren == 0)
-            return -1;
+    Bitboard moves = legalMask(own, opp);
+    if (!moves) {
+        if (passed)
+            return __builtin_popcountll(own) - __builtin_popcountll(opp);
+        return -solve(solver, opp, own, -beta, -alpha, true);
+    }
 
-        double bestScore = state.children[0]->score;
-        bestMove = state.children[0]->move;
-        free(state.children[0]);
-        for (int i = 1; i < state.numChildren; ++i) {
-            bool newBest;
-            if (color == BLACK) {
-                newBest = state.children[i]->score >= bestScore;
-            } else {
-                newBest = state.children[i]->score <= bestScore;
+    Child children[64];
+    int n = orderChildren(own, opp, moves, children);
+    int best = -65;
+    for (int i = 0; i < n; ++i) {
+        int score = -solve(solver, children[i].opp, children[i].own,
+                           -beta, -alpha, false);
+        if (score > best) {
+            best = score;
+            if (best > alpha) {
+                alpha = best;
+                if (alpha >= beta)
+                    break;
             }
+        }
+    }
+    return best;
+}
+
+// Returns the best square for the player to move, or -1 for a pass
+int solveRoot(Solver *solver, Bitboard own, Bitboard opp, int *score) {
+    Child children[64];
+    int n = orderChildren(own, opp, legalMask(own, opp), children);
+    int alpha = -65;
+    int best = -1;
+    for (int i = 0; i < n; ++i) {
+        int value = -solve(solver, children[i].opp, children[i].own,
+                           -64, -alpha, false);
+        if (value > alpha) {
+            alpha = value;
+            best = children[i].square;
+        }
+    }
+    *score = alpha;
+    return best;
+}
 
-            if (newBest) {
-                bestScore = state.children[i]->score;
-                bestMove = state.children[i]->move;
+
+typedef struct Worker {
+    Search search;
+    pthread_t thread;
+    int id;
+    State color;
+    int maxPlies;
+    int completedPlies;
+    Coord bestMove;
+    double bestScore;
+} Worker;
+
+// Index of the best of the root moves searched so far. Like search(), only
+// a strictly better score replaces the best move, since a later move that
+// fails low can return a bound equal to the best score.
+int bestRootMove(Search *s, State color) {
+    int best = 0;
+    for (int i = 1; i < s->numRootMoves; ++i) {
+        bool newBest;
+        if (color == BLACK) {
+            newBest = s->rootScores[i] > s->rootScores[best];
+        } else {
+            newBest = s->rootScores[i] < s->rootScores[best];
+        }
+        if (newBest)
+            best = i;
+    }
+    return best;
+}
+
+// Bounds on the estimated growth in time from one iteration to the next
+#define MIN_BRANCHING 1.5
+#define MAX_BRANCHING 8.0
+// Share of an iteration spent on its first root move
+#define FIRST_MOVE_SHARE 0.5
+
+// Iterative deepening on one thread. With Lazy SMP every thread searches the
+// same root and they share work through the transposition table; odd helper
+// threads search one ply deeper to spread the threads over more of the tree.
+void *runWorker(void *arg) {
+    Worker *w = arg;
+    Search *s = &w->search;
+    w->completedPlies = 0;
+    double lastPly = 0.0;
+    double branching = MAX_BRANCHING / 2;
+
+    for (int plies = 1 + (w->id & 1); plies <= w->maxPlies; ++plies) {
+        s->plies = plies;
+
+        // Only start an iteration if its first root move, which is enough
+        // to use its result, is expected to finish
+        double plyStart = getWallTime();
+        double elapsed = plyStart - s->startTime;
+        if (elapsed >= s->softTime ||
+            elapsed + lastPly * branching * FIRST_MOVE_SHARE > s->maxTime)
+            break;
+
+        if (!search(s, 0, -INF, INF)) {
+            // The previous best move is searched first, through the
+            // transposition table. Once it has finished, the other
+            // finished moves only score above it if they are better at
+            // this depth, so the interrupted iteration can still be used.
+            if (w->completedPlies > 0 && s->numRootMoves > 0 &&
+                s->rootMoves[0].r == w->bestMove.r &&
+                s->rootMoves[0].c == w->bestMove.c) {
+                int best = bestRootMove(s, w->color);
+                w->bestMove = s->rootMoves[best];
+                w->bestScore = s->rootScores[best];
+                if (w->id == 0 && verbose)
+                    printf("Kept %d, %d of the unfinished ply (%d moves "
+                           "searched)\n", w->bestMove.r, w->bestMove.c,
+                           s->numRootMoves);
             }
-            free(state.children[i]);
+            break;
+        }
+
+        if (s->numRootMoves == 0)
+            break;
+
+        int best = bestRootMove(s, w->color);
+        double bestScore = s->rootScores[best];
+        Coord bestMove = s->rootMoves[best];
+        w->completedPlies = plies;
+        w->bestMove = bestMove;
+        w->bestScore = bestScore;
+
+        double plyTime = getWallTime() - plyStart;
+        if (lastPly > 0.0) {
+            branching = plyTime / lastPly;
+            branching = branching < MIN_BRANCHING ? MIN_BRANCHING :
+                        branching > MAX_BRANCHING ? MAX_BRANCHING : branching;
+        }
+        lastPly = plyTime;
+
+        if (w->id == 0)
+            lastStats.plyTimes[lastStats.numPlyTimes++] = plyTime;
+
+        if (w->id == 0 && verbose)
+            printf("Searched %d plies and got %d, %d (%f), peak search "
+                   "memory %zu bytes\n", plies, bestMove.r, bestMove.c,
+                   bestScore, (s->peakDepth + 1) * sizeof(GameState));
+    }
+    return NULL;
+}
+
+
+// Results of findMoveBitboards other than a move; moves are never negative
+#define SEARCH_FAILED -1
+#define NO_MOVE -2
+
+// Searches the position given as one mask per player, which BitBoard
+// already stores, so Python can pass it without building an array. Returns
+// the move, SEARCH_FAILED if memory for the search could not be allocated
+// or NO_MOVE if the player has to pass.
+int findMoveBitboards(Bitboard black, Bitboard white, State color,
+                      double maxTime, double softTime, int threads) {
+    double startTime = getWallTime();
+    int stop = 0;
+
+    if (TABLE == NULL)
+        TABLE = calloc(1ULL << TT_BITS, sizeof(TTEntry));
+    if (TABLE == NULL)
+        return SEARCH_FAILED;
+    generation = (generation + 1) & 0xFFFF;
+    memset(&lastStats, 0, sizeof(lastStats));
+    lastStats.score = NAN;
+
+    int square = color == BLACK ? bookMove(black, white) :
+                                  bookMove(white, black);
+    if (square >= 0) {
+        if (verbose)
+            printf("Book move %d, %d\n", square >> 3, square & 7);
+        lastStats.source = SOURCE_BOOK;
+        lastStats.time = getWallTime() - startTime;
+        return coordToInt((Coord){square >> 3, square & 7});
+    }
+    if (64 - __builtin_popcountll(black | white) <= endgameEmpties) {
+        // Give the exact solver half of the budget and fall back to the
+        // heuristic search if it does not finish
+        Solver solver = {startTime + maxTime / 2, 0, false};
+        int score;
+        square = color == BLACK ?
+            solveRoot(&solver, black, white, &score) :
+            solveRoot(&solver, white, black, &score);
+        lastStats.nodes += solver.nodes;
+        if (!solver.aborted && square >= 0) {
+            if (verbose)
+                printf("Solved endgame and got %d, %d (%+d disks, %llu "
+                       "nodes)\n", square >> 3, square & 7, score,
+                       (unsigned long long)solver.nodes);
+            lastStats.source = SOURCE_ENDGAME;
+            lastStats.depth = 64 - __builtin_popcountll(black | white);
+            lastStats.time = getWallTime() - startTime;
+            return coordToInt((Coord){square >> 3, square & 7});
         }
+        if (verbose)
+            printf("Endgame solver stopped after %llu nodes\n",
+                   (unsigned long long)solver.nodes);
+    }
 
-        printf("Searched %d plies and got %d, %d (%f)\n", plies, bestMove.r, bestMove.c, bestScore);
+    if (threads < 1)
+        threads = 1;
+    Worker *workers = calloc(threads, sizeof(Worker));
+    if (workers == NULL)
+        return SEARCH_FAILED;
+
+    for (int i = 0; i < threads; ++i) {
+        Worker *w = &workers[i];
+        Search *s = &w->search;
+        s->startTime = startTime;
+        s->maxTime = maxTime;
+        s->softTime = softTime;
+        s->stop = &stop;
+        s->peakDepth = 0;
+
+        GameState *state = &s->stack[0];
+        state->black = black;
+        state->white = white;
+        state->depth = 0;
+        state->player = getOpponent(color);
+        if (patternPhases)
+            initPatterns(state);
+
+        updateStateCounts(state);
+        w->id = i;
+        w->color = color;
+        w->maxPlies = 64 - (state->numBlack + state->numWhite);
+        if (maxDepth > 0 && maxDepth < w->maxPlies)
+            w->maxPlies = maxDepth;
+    }
+
+    for (int i = 1; i < threads; ++i)
+        pthread_create(&workers[i].thread, NULL, runWorker, &workers[i]);
+    runWorker(&workers[0]);
+    __atomic_store_n(&stop, 1, __ATOMIC_RELAXED);
+    for (int i = 1; i < threads; ++i)
+        pthread_join(workers[i].thread, NULL);
+
+    // Use the deepest completed iteration, preferring the main thread
+    Worker *best = &workers[0];
+    for (int i = 1; i < threads; ++i) {
+        if (workers[i].completedPlies > best->completedPlies)
+            best = &workers[i];
+    }
+
+    for (int i = 0; i < threads; ++i) {
+        Search *s = &workers[i].search;
+        lastStats.nodes += s->nodes;
+        lastStats.ttProbes += s->ttProbes;
+        lastStats.ttHits += s->ttHits;
+        lastStats.cutoffs += s->cutoffs;
+        lastStats.firstMoveCutoffs += s->firstMoveCutoffs;
+    }
+    lastStats.depth = best->completedPlies;
+    lastStats.score = best->completedPlies > 0 ? best->bestScore : NAN;
+    lastStats.time = getWallTime() - startTime;
+
+    int move;
+    if (best->completedPlies > 0) {
+        move = coordToInt(best->bestMove);
+    } else {
+        // Out of time before the first ply finished, so play any legal move
+        Bitboard moves = color == BLACK ? legalMask(black, white) :
+                                          legalMask(white, black);
+        move = NO_MOVE;
+        if (moves) {
+            int square = __builtin_ctzll(moves);
+            move = coordToInt((Coord){square >> 3, square & 7});
+        }
     }
+    free(workers);
+    return move;
+}
+
+int findMoveParallel(Board board, State color, double maxTime, int threads) {
+    Bitboard black, white;
+    boardToBitboards(board, &black, &white);
+    return findMoveBitboards(black, white, color, maxTime, maxTime, threads);
+}
 
 
-    return coordToInt(bestMove);
+// Best move stored in the transposition table for the player to move, or -1
+int tableMove(Bitboard black, Bitboard white, State player) {
+    double score;
+    int depth, bound, move;
+    if (TABLE == NULL ||
+        !probeTT(hashPosition(black, white, player), &score, &depth, &bound,
+                 &move))
+        return -1;
+    return move;
+}
+
+// Counts the leaves of the game tree to the given depth for the player with
+// disks own. A pass is a ply of its own and finished games are leaves.
+uint64_t perft(Bitboard own, Bitboard opp, int depth) {
+    if (depth == 0)
+        return 1;
+
+    Bitboard moves = legalMask(own, opp);
+    if (moves == 0) {
+        if (legalMask(opp, own) == 0)
+            return 1;
+        return perft(opp, own, depth - 1);
+    }
+    if (depth == 1)
+        return __builtin_popcountll(moves);
+
+    uint64_t total = 0;
+    for (; moves; moves &= moves - 1) {
+        Bitboard move = moves & -moves;
+        Bitboard flips = flipMask(own, opp, move);
+        total += perft(opp ^ flips, own | move | flips, depth - 1);
+    }
+    return total;
+}
+
+int findMove(Board board, State color, double maxTime) {
+    return findMoveParallel(board, color, maxTime, 1);
 }
 
 int main() {
@@ -478,9 +1282,11 @@ int main() {
                    {0, 0, 0, 0, 0, 0, 0, 0}};
     int m = findMove(board, BLACK, 5.0);
     Coord c = intToCoord(m);
-    printBoard(board);
+    GameState state;
+    boardToBitboards(board, &state.black, &state.white);
+    printBoard(state.black, state.white);
     printf("\n");
-    makeMove(board, c, BLACK);
-    printBoard(board);
+    makeMove(&state, c, BLACK);
+    printBoard(state.black, state.white);
     printf("Move: %d, %d\n", c.r, c.c);
 }
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""Generates training positions from self-play games.
+
+Games are played headless through OthelloGame in parallel worker processes.
+Every sampled position is labelled with the mover's search score and the
+final result, and the positions are streamed to a binary file in blocks of
+columns that can be read back one block at a time."""
+
+import argparse
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import math
+import os
+import random
+import struct
+import sys
+
+from game import BitBoard, OthelloGame, State, silence
+from moderator import discover_players
+
+MAGIC = b"OTHDATA1"
+BLOCK_HEADER = struct.Struct("<I")  # number of positions in the block
+
+# Column name and array typecode, in the order they are stored in a block:
+# the disks of each player, the player to move, the number of moves played,
+# the mover's search score from black's point of view (NaN when the move
+# did not come from the heuristic search) and the final disk difference,
+# black minus white
+COLUMNS = (("black", "Q"),
+           ("white", "Q"),
+           ("player", "B"),
+           ("ply", "B"),
+           ("score", "f"),
+           ("result", "b"))
+
+
+class DatasetWriter(object):
+    """Appends positions to a dataset file, writing a block whenever
+    block_size positions have been buffered."""
+
+    def __init__(self, path, block_size=4096):
+        self.block_size = block_size
+        self.count = 0
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            with open(path, "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise Exception("'{}' is not a dataset".format(path))
+        self.file = open(path, "ab")
+        if not exists:
+            self.file.write(MAGIC)
+        self.columns = self.new_columns()
+
+    @staticmethod
+    def new_columns():
+        return [array(typecode) for name, typecode in COLUMNS]
+
+    def write(self, black, white, player, ply, score, result):
+        for column, value in zip(self.columns,
+                                 (black, white, player, ply, score, result)):
+            column.append(value)
+        if len(self.columns[0]) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        size = len(self.columns[0])
+        if not size:
+            return
+        self.file.write(BLOCK_HEADER.pack(size))
+        for column in self.columns:
+            if sys.byteorder != "little":
+                column.byteswap()
+            column.tofile(self.file)
+        self.file.flush()
+        self.count += size
+        self.columns = self.new_columns()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_blocks(path):
+    """Yields each block of a dataset as {column name: array}, so that
+    datasets larger than memory can be processed in pieces. NumPy users can
+    wrap the arrays with numpy.frombuffer without copying them."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise Exception("'{}' is not a dataset".format(path))
+        while True:
+            header = f.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                return
+            size, = BLOCK_HEADER.unpack(header)
+            block = {}
+            for name, typecode in COLUMNS:
+                column = array(typecode)
+                column.fromfile(f, size)
+                if sys.byteorder != "little":
+                    column.byteswap()
+                block[name] = column
+            yield block
+
+
+def explorer(player_class, random_plies, max_depth, seed):
+    """Returns a subclass of player_class that plays random moves for the
+    first random_plies moves of the game, so that games differ, and
+    searches to at most max_depth."""
+    rng = random.Random(seed)
+
+    class Explorer(player_class):
+        def move(self, board):
+            if board.total_count() - 4 < random_plies:
+                self.stats = {}
+                return rng.choice(board.legal_moves(self.color))
+            return super().move(board)
+    Explorer.__name__ = player_class.__name__
+    Explorer.max_depth = max_depth
+    return Explorer
+
+
+def play_game(job):
+    """Plays one game and returns its sampled positions as (black, white,
+    player, ply, score, result) tuples."""
+    from ui.null import NullUI
+
+    name, timeout, max_depth, random_plies, sample, seed = job
+    player_class = discover_players()[name]
+    game = OthelloGame(explorer(player_class, random_plies, max_depth, seed),
+                       explorer(player_class, random_plies, max_depth,
+                                seed + 1),
+                       ui=NullUI, timeout=timeout, board_type=BitBoard)
+    game.play(silent=True)
+    if game.board.legal_moves(State.black) or \
+            game.board.legal_moves(State.white):
+        # A player was disqualified, so the game has no real result
+        return []
+    result = game.board.count(State.black) - game.board.count(State.white)
+
+    rng = random.Random(seed)
+    board = BitBoard()
+    positions = []
+    for entry in game.record:
+        move = entry["move"]
+        if move is None:
+            continue
+        ply = board.total_count() - 4
+        score = entry["stats"].get("score")
+        if ply >= random_plies and rng.random() < sample:
+            positions.append((board.black, board.white, entry["player"], ply,
+                              math.nan if score is None else score, result))
+        board.make_move(move[0], move[1], entry["player"])
+    return positions
+
+
+def generate(path, name, games, timeout=1.0, max_depth=None, random_plies=8,
+             sample=0.5, seed=0, jobs=None, log=None):
+    """Plays games in parallel and streams their positions to path. Only a
+    few games per worker are queued at a time, so any number of games can
+    be played in constant memory."""
+    jobs = jobs or os.cpu_count()
+    queue = ((name, timeout, max_depth, random_plies, sample, seed + 2 * i)
+             for i in range(games))
+    played = 0
+    with DatasetWriter(path) as writer, \
+            ProcessPoolExecutor(max_workers=jobs,
+                                initializer=silence) as executor:
+        def collect(futures):
+            nonlocal played
+            for future in futures:
+                for position in future.result():
+                    writer.write(*position)
+                played += 1
+                if log is not None:
+                    log(played, writer.count + len(writer.columns[0]))
+
+        pending = set()
+        for job in queue:
+            pending.add(executor.submit(play_game, job))
+            if len(pending) >= 2 * jobs:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(pending)
+        count = writer.count + len(writer.columns[0])
+    return count
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Othello self-play data")
+    parser.add_argument("-p", "--player", default="cAI",
+                        help="The player used for self-play games")
+    parser.add_argument("-n", "--games", type=int, default=100,
+                        help="The number of games to play")
+    parser.add_argument("-T", "--timeout", type=float, default=1.0,
+                        help="The time limit passed to the players")
+    parser.add_argument("-d", "--depth", type=int,
+                        help="Search to at most this many plies")
+    parser.add_argument("-r", "--random-plies", type=int, default=8,
+                        help="The number of random moves opening each game")
+    parser.add_argument("-s", "--sample", type=float, default=0.5,
+                        help="The share of positions to keep")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="The number of games to play at once")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="selfplay.bin",
+                        help="The dataset file, appended to if it exists")
+    args = parser.parse_args(argv)
+
+    def log(played, positions):
+        print("\r{} games, {} positions".format(played, positions), end="",
+              file=sys.stderr, flush=True)
+
+    count = generate(args.output, args.player, args.games,
+                     timeout=args.timeout, max_depth=args.depth,
+                     random_plies=args.random_plies, sample=args.sample,
+                     seed=args.seed, jobs=args.jobs, log=log)
+    print(file=sys.stderr)
+    print("Wrote {} positions to {}".format(count, args.output))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Fits the weights of the six evaluation heuristics to positions from
+selfplay.py and writes them to a file that both AIs load at startup.
+
+The fit is a least squares regression of the search score or the final
+result on the heuristics. Features are extracted a block at a time in
+parallel with batch.features and reduced to the moments of the normal
+equations, so datasets of any size are fitted in constant memory."""
+
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import json
+import math
+import os
+import sys
+
+WEIGHTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "weights.json")
+
+FEATURES = ("piece", "corners", "corner_closeness", "mobility", "frontier",
+            "disk_squares")
+
+# Built-in weights, used when there is no weights file
+DEFAULT_WEIGHTS = (10, 801.724, 382.026, 78.922, 74.396, 10)
+
+
+def load_weights(path=WEIGHTS_PATH, default=DEFAULT_WEIGHTS):
+    """Returns the weights stored at path, or default if there is no such
+    file."""
+    if path is None or not os.path.exists(path):
+        return default
+    with open(path) as f:
+        weights = json.load(f)["weights"]
+    if len(weights) != len(FEATURES):
+        raise Exception("'{}' has {} weights, expected {}".format(
+            path, len(weights), len(FEATURES)))
+    return tuple(float(weight) for weight in weights)
+
+
+def save_weights(path, weights, **info):
+    with open(path, "w") as f:
+        json.dump(dict(info, features=FEATURES, weights=list(weights)), f,
+                  indent=2)
+        f.write("\n")
+
+
+def block_moments(block, target, min_ply, holdout):
+    """Returns the moments (X'X, X'y, y'y, n) of the block's training rows
+    and of its validation rows, every holdout-th row."""
+    import batch
+    np = batch.np
+
+    boards = np.stack([np.frombuffer(block[color], dtype=np.uint64)
+                       for color in ("black", "white")], axis=1)
+    y = np.frombuffer(block[target], dtype=np.float32 if target == "score"
+                      else np.int8).astype(np.float64)
+    keep = (np.frombuffer(block["ply"], dtype=np.uint8) >= min_ply) & \
+        np.isfinite(y)
+    X = batch.features(boards)
+
+    validation = np.zeros(len(y), dtype=bool)
+    if holdout:
+        validation[::holdout] = True
+    moments = []
+    for rows in (keep & ~validation, keep & validation):
+        Xr, yr = X[rows], y[rows]
+        moments.append((Xr.T @ Xr, Xr.T @ yr, yr @ yr, len(yr)))
+    return moments
+
+
+def add_moments(a, b):
+    if a is None:
+        return b
+    return tuple(x + y for x, y in zip(a, b))
+
+
+def collect(path, target="result", min_ply=0, holdout=10, jobs=None,
+            log=None):
+    """Returns the summed training and validation moments of a dataset,
+    extracting features from a few blocks per worker at a time."""
+    from selfplay import read_blocks
+
+    jobs = jobs or os.cpu_count()
+    train = validation = None
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        def reduce(futures):
+            nonlocal train, validation
+            for future in futures:
+                block_train, block_validation = future.result()
+                train = add_moments(train, block_train)
+                validation = add_moments(validation, block_validation)
+            if log is not None and train is not None:
+                log(train[3] + validation[3])
+
+        pending = set()
+        for block in read_blocks(path):
+            pending.add(executor.submit(block_moments, block, target,
+                                        min_ply, holdout))
+            if len(pending) >= 2 * jobs:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                reduce(done)
+        reduce(pending)
+    if train is None or train[3] == 0:
+        raise Exception("'{}' has no positions to fit".format(path))
+    return train, validation
+
+
+def fit(moments, ridge=1e-6):
+    """Solves the normal equations, with ridge regularization relative to
+    the scale of each feature."""
+    import batch
+    np = batch.np
+
+    XX, Xy, yy, n = moments
+    return np.linalg.solve(XX + ridge * np.diag(np.diag(XX) + 1e-12), Xy)
+
+
+def scaled_error(weights, moments):
+    """Returns the RMS error of the evaluation after scaling it to fit the
+    targets best. Searches only compare scores, so this measures weights
+    independently of their overall scale."""
+    import batch
+    np = batch.np
+
+    XX, Xy, yy, n = moments
+    w = np.asarray(weights, dtype=np.float64)
+    variance = w @ XX @ w
+    explained = (w @ Xy) ** 2 / variance if variance > 0 else 0.0
+    return math.sqrt(max(yy - explained, 0.0) / max(n, 1))
+
+
+def main(argv):
+    from players.AI import WEIGHTS
+
+    parser = argparse.ArgumentParser(description="Tune evaluation weights")
+    parser.add_argument("dataset", help="A dataset written by selfplay.py")
+    parser.add_argument("-t", "--target", choices=("result", "score"),
+                        default="result",
+                        help="Fit the final disk difference or the score of "
+                             "the search")
+    parser.add_argument("-m", "--min-ply", type=int, default=0,
+                        help="Skip positions with fewer moves played")
+    parser.add_argument("-l", "--ridge", type=float, default=1e-6,
+                        help="The strength of the ridge regularization")
+    parser.add_argument("-v", "--holdout", type=int, default=10,
+                        help="Keep every nth position back for validation "
+                             "(0 to use every position)")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="The number of blocks to process at once")
+    parser.add_argument("-o", "--output",
+                        help="The weights file to write (the AIs load {})"
+                             .format(os.path.basename(WEIGHTS_PATH)))
+    args = parser.parse_args(argv)
+
+    def log(positions):
+        print("\r{} positions".format(positions), end="", file=sys.stderr,
+              flush=True)
+
+    train, validation = collect(args.dataset, target=args.target,
+                                min_ply=args.min_ply, holdout=args.holdout,
+                                jobs=args.jobs, log=log)
+    print(file=sys.stderr)
+
+    weights = fit(train, args.ridge)
+    # Keep the scores on the scale of the current weights
+    current = sum(WEIGHTS[i] * train[0][i][j] * WEIGHTS[j]
+                  for i in range(len(WEIGHTS)) for j in range(len(WEIGHTS)))
+    new = weights @ train[0] @ weights
+    if new > 0:
+        weights *= math.sqrt(current / new)
+
+    print("{:18} {:>12} {:>12}".format("Feature", "Current", "Fitted"))
+    for name, before, after in zip(FEATURES, WEIGHTS, weights):
+        print("{:18} {:12.3f} {:12.3f}".format(name, before, after))
+    moments = validation if validation[3] else train
+    print("{} error on {} {} positions: {:.3f} -> {:.3f}".format(
+        args.target.capitalize(), moments[3],
+        "validation" if validation[3] else "training",
+        scaled_error(WEIGHTS, moments), scaled_error(weights, moments)))
+
+    if args.output is None:
+        print("Pass -o {} to play with these weights".format(WEIGHTS_PATH))
+        return
+    save_weights(args.output, [round(float(weight), 3) for weight in weights],
+                 target=args.target, positions=int(train[3]))
+    print("Wrote", args.output)
+    if os.path.abspath(args.output) == WEIGHTS_PATH:
+        print("Both AIs now play with these weights; delete the file to go "
+              "back to the built-in ones")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -61,6 +61,7 @@ class GraphicalUI(UI):
         self.player_2_label.place(relx=1, anchor=tkinter.NE)
 
         self.disks = []
+        self.shown = [[State.empty] * 8 for row in range(8)]
         disk_padding = 7
         for row in range(8):
             dy = row * 50
@@ -127,12 +128,17 @@ class GraphicalUI(UI):
                 GraphicalUI.BLACK)
         )
 
+        colors = {
+            State.white: GraphicalUI.WHITE,
+            State.black: GraphicalUI.BLACK,
+            State.empty: GraphicalUI.GREEN
+        }
+        board = self.game.board.board
         for row in range(8):
             for col in range(8):
-                colors = {
-                    State.white: GraphicalUI.WHITE,
-                    State.black: GraphicalUI.BLACK,
-                    State.empty: GraphicalUI.GREEN
-                }
-                color = colors[self.game.board.board[row][col]]
-                self.canvas.itemconfig(self.disks[row][col], fill=color)
+                state = board[row][col]
+                # Only reconfigure the disks that changed since last update
+                if self.shown[row][col] is not state:
+                    self.shown[row][col] = state
+                    self.canvas.itemconfig(self.disks[row][col],
+                                           fill=colors[state])
@@ -0,0 +1,10 @@
+from . import UI
+
+
+class NullUI(UI):
+
+    def get_move(self):
+        raise Exception("The null UI can not get moves from the user.")
+
+    def update(self):
+        pass